@@ -1,29 +1,77 @@
 import os
-import h5py
 import asyncio
 from ase.calculators.calculator import Calculator, CalculatorSetupError
 from ase.calculators.calculator import CalculationFailed
 from afobj.basis.qemp2 import QEMP2
 from afobj.basis.gto_h5 import gen_qe_gto
 
+async def remove_path(path):
+  # delete a file or directory tree without blocking the event loop
+  import shutil
+  loop = asyncio.get_running_loop()
+  if os.path.isdir(path):
+    await loop.run_in_executor(None, shutil.rmtree, path)
+  else:
+    await loop.run_in_executor(None, os.remove, path)
+
 class AQEMP2(QEMP2):
-  async def acalc(self, atoms=None, properties=['energy']):
-    system_changes = ['positions', 'numbers', 'cell', 'pbc',
-      'initial_charges', 'initial_magmoms']
-    Calculator.calculate(self, atoms, properties, system_changes)
-    self.write_input(self.atoms, properties, system_changes)
-    if self.command is None:
-      raise CalculatorSetupError(
-        'Please set ${} environment variable '
-        .format('ASE_' + self.name.upper() + '_COMMAND') +
-        'or supply the command keyword')
-    command = self.command
-    if 'PREFIX' in command:
-      command = command.replace('PREFIX', self.prefix)
+  timeout = None  # wall-clock limit of one pp.x run in seconds
+  poll = 1.0  # seconds between scans of the .pwo file
+  failure_patterns = ['Error in routine', 'MPI_ABORT', 'Segmentation fault']
+  scheduler = None  # share cores between concurrent runs
+  timer = None  # see timing.StageTimer
 
+  def scan_output(self, fout, pos):
+    # new complete lines in fout starting at byte pos
+    if not os.path.isfile(fout):
+      return pos, []
+    with open(fout, 'rb') as f:
+      f.seek(pos)
+      text = f.read()
+    iend = text.rfind(b'\n') + 1
+    lines = text[:iend].decode(errors='replace').splitlines()
+    return pos+iend, lines
+
+  async def monitor(self, proc):
+    # return why proc must be stopped, None once it exits normally
+    import time
+    fout = '%s.pwo' % self.label
+    tstart = time.monotonic()
+    pos = 0
+    while True:
+      try:
+        await asyncio.wait_for(proc.wait(), self.poll)
+      except asyncio.TimeoutError:
+        pass
+      pos, lines = self.scan_output(fout, pos)
+      for line in lines:
+        for pattern in self.failure_patterns:
+          if pattern in line:
+            return 'found "%s"' % line.strip()
+      if proc.returncode is not None:
+        return None
+      if self.timeout is not None and time.monotonic()-tstart > self.timeout:
+        return 'exceeded timeout of %s s' % self.timeout
+
+  async def kill(self, proc, grace=5.):
+    # signal the whole session: shell, mpirun and all ranks
+    import signal
+    for sig in [signal.SIGTERM, signal.SIGKILL]:
+      try:
+        os.killpg(proc.pid, sig)
+      except ProcessLookupError:
+        break
+      try:
+        await asyncio.wait_for(proc.wait(), grace)
+        break
+      except asyncio.TimeoutError:
+        pass
+
+  async def execute(self, command, **kwargs):
     try:
       command = 'cd %s; %s' % (self.directory, command)
-      proc = await asyncio.create_subprocess_shell(command)
+      proc = await asyncio.create_subprocess_shell(command,
+        start_new_session=True, **kwargs)
     except OSError as err:
       # Actually this may never happen with shell=True, since
       # probably the shell launches successfully.  But we soon want
@@ -32,7 +80,17 @@ class AQEMP2(QEMP2):
       msg = 'Failed to execute "{}"'.format(command)
       raise EnvironmentError(msg) from err
 
-    await proc.communicate()
+    try:
+      reason = await self.monitor(proc)
+    except BaseException:  # e.g. cancelled, do not leave ranks running
+      await self.kill(proc)
+      raise
+    if reason is not None:
+      await self.kill(proc)
+      path = os.path.abspath(self.directory)
+      msg = 'Calculator "{}" aborted in {}: {}'.format(
+        self.name, path, reason)
+      raise CalculationFailed(msg)
     errorcode = proc.returncode
 
     if errorcode:
@@ -42,7 +100,38 @@ class AQEMP2(QEMP2):
                                             path, errorcode))
       raise CalculationFailed(msg)
 
-    self.read_results()
+  async def acalc(self, atoms=None, properties=['energy']):
+    system_changes = ['positions', 'numbers', 'cell', 'pbc',
+      'initial_charges', 'initial_magmoms']
+    from afobj.basis.timing import timed
+    Calculator.calculate(self, atoms, properties, system_changes)
+    with timed(self.timer, 'write_input'):
+      self.write_input(self.atoms, properties, system_changes)
+    if self.command is None:
+      raise CalculatorSetupError(
+        'Please set ${} environment variable '
+        .format('ASE_' + self.name.upper() + '_COMMAND') +
+        'or supply the command keyword')
+    command = self.command
+    if 'PREFIX' in command:
+      command = command.replace('PREFIX', self.prefix)
+
+    # hold a slot of cores for the whole run, see scheduler.CoreScheduler
+    slot = None
+    if self.scheduler is not None:
+      slot = await self.scheduler.acquire()
+    try:
+      kwargs = {}
+      if slot is not None:
+        command = self.scheduler.expand(command, slot)
+        kwargs = self.scheduler.popen_kwargs(slot)
+      with timed(self.timer, 'qe'):
+        await self.execute(command, **kwargs)
+    finally:
+      if slot is not None:
+        self.scheduler.release(slot)
+    with timed(self.timer, 'read_results'):
+      self.read_results()
 
 class QEGTO:
 
@@ -57,7 +146,6 @@ class QEGTO:
     self.write_str = kwargs.pop('write_str', False)
     self.atoms = atoms
     self.basis_set = basis_set
-    self.iteration = 0
     self.parameters = parameters
     self.default_parameters = dict(
       prefix = prefix,
@@ -67,40 +155,262 @@ class QEGTO:
     )
     self.clean_gto_h5 = kwargs.pop('clean_gto_h5', False)
     self.fband_h5 = kwargs.pop('fband_h5', 'band.h5')
-    self.calc = AQEMP2()
+    self.results = None
+    # continue the numbering of a restarted run, so labels and the
+    #  history in fband_h5 never repeat an iteration
+    from afobj.basis.results_store import next_iteration
+    self.iteration = next_iteration(self.fband_h5)
+    # keep write_pyscf_orbitals.py running, see wpo_server_command
+    self.wpo_server = kwargs.pop('wpo_server', False)
+    self.wpo_proc = None
+    self.wpo_lock = None
+    self.wpo_loop = None  # event loop owning wpo_lock
+    # reuse finished evaluations across restarts, see mp2_cache.MP2Cache
+    self.mp2_cache = None
+    fcache = kwargs.pop('mp2_cache', None)
+    if fcache is not None:
+      from afobj.basis.mp2_cache import MP2Cache
+      max_entries = kwargs.pop('mp2_cache_size', None)
+      self.mp2_cache = MP2Cache(fcache, max_entries=max_entries)
+    self.cache_decimals = kwargs.pop('cache_decimals', 10)
+    # screen near linear dependence before running QE, see opt.check_lindep
+    self.max_cond = kwargs.pop('max_cond', None)
+    self.lindep_penalty = kwargs.pop('lindep_penalty', None)
+    # read SCF from a node-local copy of outdir, see staging.StagedOutdir
+    self.stage_scratch = kwargs.pop('stage_outdir', None)
+    self.stage_link = kwargs.pop('stage_link', False)
+    self.staged = None
+    self.stage_lock = None
+    # transient run directories, see scratch.ScratchManager; WPO_COMMAND
+    #  must then find SCF files via WORKDIR, not ../
+    self.scratch = kwargs.pop('scratch', None)
+    # per-stage timing, JSON lines, see timing.summarize
+    self.timing_log = kwargs.pop('timing_log', None)
+    self.calc = AQEMP2()  # template for new_calc
+    self.calc.timeout = kwargs.pop('qe_timeout', None)
+    self.calc.scheduler = kwargs.pop('scheduler', None)
+    self.last_calc = None
 
   async def run(self, cmd):
-    proc = await asyncio.create_subprocess_shell(
-      cmd,
-      stdout=asyncio.subprocess.PIPE,
-      stderr=asyncio.subprocess.PIPE)
-    stdout, stderr = await proc.communicate()
+    sched = self.calc.scheduler
+    if sched is None:
+      proc = await asyncio.create_subprocess_shell(
+        cmd,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE)
+      stdout, stderr = await proc.communicate()
+      return proc.returncode, stdout, stderr
+    slot = await sched.acquire()
+    try:
+      proc = await asyncio.create_subprocess_shell(
+        sched.expand(cmd, slot),
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        **sched.popen_kwargs(slot))
+      stdout, stderr = await proc.communicate()
+    finally:
+      sched.release(slot)
     return proc.returncode, stdout, stderr
 
-  def wpo_command(self, path, fgto_h5):
+  def wpo_command(self, path, fgto_h5, ref=None):
+    # PATH is the run directory, WORKDIR the directory holding run
+    #  directories under tmpdir, even when PATH is on scratch; REFARGS
+    #  becomes --ref for a reference directory ref, see write_reference
     cmd = os.environ.get('WPO_COMMAND', None)
     if cmd is None:
       msg = 'please define WPO_COMMAND environment variable, e.g.\n'
-      msg += 'cd PATH; write_pyscf_orbitals.py FORB'
-      msg += '../scf.inp ../scf.out $lmax x0.dat\n'
-      raise RuntimeError(cmd)
+      msg += 'cd PATH; write_pyscf_orbitals.py FORB '
+      msg += 'WORKDIR/scf.inp WORKDIR/scf.out $lmax x0.dat REFARGS\n'
+      raise RuntimeError(msg)
     for key in ['PATH', 'FORB']:
       if key not in cmd:
         msg = '%s must be in WPO_COMMAND' % key
         raise RuntimeError(msg)
+    if self.scratch is not None and '../' in cmd:
+      msg = 'run directories are on scratch, so relative paths in '
+      msg += 'WPO_COMMAND do not reach tmpdir; use WORKDIR instead of ..\n'
+      msg += cmd
+      raise RuntimeError(msg)
+    workdir = os.path.abspath(os.path.dirname(self.tmpdir) or '.')
+    cmd = cmd.replace('WORKDIR', workdir)
     cmd = cmd.replace('PATH', path).replace('FORB', fgto_h5)
-    return cmd
+    refargs = ''
+    if ref is not None:
+      ref = os.path.abspath(ref)
+      refargs = '--ref %s %s' % (os.path.join(ref, fgto_h5),
+        os.path.join(ref, 'x0.dat'))
+    return cmd.replace('REFARGS', refargs)
 
-  async def get_mp2_energy(self, x, keep_qe_io=True):
-    # get parameters
+  def incremental_orbitals(self):
+    # can write_orbitals reuse a reference directory?
+    if self.wpo_server:
+      return True
+    return 'REFARGS' in os.environ.get('WPO_COMMAND', '')
+
+  def wpo_server_command(self, fgto_h5):
+    cmd = os.environ.get('WPO_SERVER_COMMAND', None)
+    if cmd is None:
+      msg = 'please define WPO_SERVER_COMMAND environment variable, e.g.\n'
+      msg += 'write_pyscf_orbitals.py --serve FORB '
+      msg += 'scf.inp scf.out $lmax x0.dat\n'
+      raise RuntimeError(msg)
+    if 'FORB' not in cmd:
+      msg = 'FORB must be in WPO_SERVER_COMMAND'
+      raise RuntimeError(msg)
+    return cmd.replace('FORB', fgto_h5)
+
+  def start_wpo_server(self, fgto_h5):
+    # plain pipes, not tied to an event loop, so the server outlives
+    #  asyncio.run; requests go through executor threads
+    import subprocess
+    cmd = self.wpo_server_command(fgto_h5)
+    self.wpo_proc = subprocess.Popen(cmd, shell=True,
+      stdin=subprocess.PIPE, stdout=subprocess.PIPE, start_new_session=True)
+
+  def wpo_request(self, path, ref=None):
+    # one line per request: directory, optionally tab and reference directory
+    line = os.path.abspath(path)
+    if ref is not None:
+      line += '\t' + os.path.abspath(ref)
+    self.wpo_proc.stdin.write((line+'\n').encode())
+    self.wpo_proc.stdin.flush()
+    return self.wpo_proc.stdout.readline()
+
+  def kill_wpo_server(self):
+    # e.g. cancelled mid-request, a late reply would answer the next one
+    import signal
+    try:
+      os.killpg(self.wpo_proc.pid, signal.SIGKILL)
+    except ProcessLookupError:
+      pass
+    self.wpo_proc.wait()
+    self.wpo_proc = None
+
+  async def stop_wpo_server(self):
+    if self.wpo_proc is None:
+      return
+    try:
+      self.wpo_proc.stdin.close()
+    except BrokenPipeError:
+      pass
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, self.wpo_proc.wait)
+    self.wpo_proc = None
+
+  async def stage_outdir(self, outdir):
+    # copy once, even if many evaluations ask at the same time
+    from afobj.basis.staging import StagedOutdir
+    if self.stage_lock is None:
+      self.stage_lock = asyncio.Lock()
+    async with self.stage_lock:
+      if self.staged is None:
+        self.staged = StagedOutdir(outdir, self.stage_scratch,
+          link=self.stage_link)
+      if self.staged.path is None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self.staged.stage)
+    return self.staged.path
+
+  async def close(self):
+    await self.stop_wpo_server()
+    if self.staged is not None:
+      self.staged.cleanup()
+    if self.results is not None:
+      await self.results.close()
+    if self.mp2_cache is not None:
+      self.mp2_cache.close()
+
+  async def write_orbitals(self, path, fgto_h5, ref=None):
+    if not self.wpo_server:
+      # execute write_pyscf_orbitals.py
+      cmd = self.wpo_command(path, fgto_h5, ref=ref)
+      ret = await self.run(cmd)
+      iret, out, err = ret
+      if iret != 0:
+        msg = 'failed to execut:\n%s' % cmd
+        raise RuntimeError(msg)
+      return int(out.decode().strip('\n'))
+    # one request at a time to the long-lived write_pyscf_orbitals.py;
+    #  the lock is per event loop, e.g. one asyncio.run per step
+    loop = asyncio.get_running_loop()
+    if self.wpo_loop is not loop:
+      self.wpo_lock = asyncio.Lock()
+      self.wpo_loop = loop
+    async with self.wpo_lock:
+      if self.wpo_proc is None:  # start once, even if many ask at once
+        self.start_wpo_server(fgto_h5)
+      try:
+        line = await loop.run_in_executor(None, self.wpo_request, path,
+          ref)
+      except BrokenPipeError:
+        line = b''
+      except BaseException:
+        self.kill_wpo_server()
+        raise
+      reply = line.decode().strip()
+      if len(reply) < 1:  # the next request starts a new server
+        code = self.wpo_proc.wait()
+        self.wpo_proc = None
+        msg = 'orbital server exited with code %s' % code
+        raise RuntimeError(msg)
+    if reply.startswith('error'):
+      msg = 'orbital server failed in %s\n%s' % (path, reply)
+      raise RuntimeError(msg)
+    return int(reply)
+
+  def new_calc(self):
+    # every evaluation gets its own calculator, configured like self.calc
+    calc = AQEMP2(command=self.calc.command)
+    calc.set(**self.calc.parameters)
+    for key in ['timeout', 'poll', 'failure_patterns', 'scheduler']:
+      setattr(calc, key, getattr(self.calc, key))
+    return calc
+
+  def cache_key(self, x, params):
+    from afobj.basis.mp2_cache import round_x, hash_key
+    xr = round_x(x, self.cache_decimals)
+    elems = sorted(set(self.atoms.get_chemical_symbols()))
+    bstrs = [self.basis_set.basis_str(elem, xr) for elem in elems]
+    kparams = dict(self.calc.parameters)
+    kparams.update(params)
+    kparams['outdir'] = os.path.abspath(params['outdir'])
+    return hash_key(xr, bstrs, kparams)
+
+  def record(self, iteration, x, emp2, evals):
+    # queue for the single fband_h5 writer, see results_store.ResultsStore
+    if self.results is None:
+      from afobj.basis.results_store import ResultsStore
+      self.results = ResultsStore(self.fband_h5)
+    self.results.append(iteration, x, emp2, evals)
+
+  def write_x0(self, path, x):
+    # input of write_pyscf_orbitals.py
+    import numpy as np
+    fx0 = '%s/x0.dat' % path  # !!!! hard-coded filename
+    if self.write_str:
+      elem = np.unique(self.atoms.get_chemical_symbols())
+      assert len(elem) == 1
+      with open(fx0, 'w') as f:
+        text = self.basis_set.basis_str(elem[0], x)
+        f.write(text)
+    else:
+      np.savetxt(fx0, x)
+
+  async def write_reference(self, x, label):
+    """ orbitals at x in tmpdir+label, for write_orbitals(ref=) to copy
+    the shells that other parameter vectors leave unchanged
+    """
     params = self.default_parameters.copy()
     params.update(self.parameters)
-    label = 'i%05d' % self.iteration
-    # make run directory
     path = self.tmpdir + label
-    if not os.path.isdir(path):
-      os.mkdir(path)
+    os.makedirs(path, exist_ok=True)
+    self.write_x0(path, x)
+    await self.write_orbitals(path, params['gto_h5'])
+    return path
 
+  async def compute_mp2_energy(self, x, path, params, timer=None,
+    ref=None):
+    from afobj.basis.timing import timed
     # step 1: generate GTO orbitals
     forb = os.path.join(path, params['gto_h5'])
 
@@ -110,51 +420,185 @@ class QEGTO:
     #  mesh=params['mesh'], fname=forb)
     #params['ngto'] = nao
 
-    # execute write_pyscf_orbitals.py
-    cmd = self.wpo_command(path, params['gto_h5'])
     # setup inputs for write_pyscf_orbitals.py
-    import numpy as np
-    fx0 = '%s/x0.dat' % path  # !!!! hard-coded filename
-    if self.write_str:
-      elem = np.unique(self.atoms.get_chemical_symbols())
-      assert len(elem) == 1
-      with open(fx0, 'w') as f:
-        text = self.basis_set.basis_str(elem[0], x)
-        f.write(text)
-    else:
-      np.savetxt(fx0, x)
+    with timed(timer, 'x0'):
+      self.write_x0(path, x)
     # go to calculator path
-    ret = await self.run(cmd)
-    iret, out, err = ret
-    if iret != 0:
-      msg = 'failed to execut:\n%s' % cmd
-      raise RuntimeError(msg)
-    nao = int(out.decode().strip('\n'))
+    with timed(timer, 'orbitals'):
+      nao = await self.write_orbitals(path, params['gto_h5'], ref=ref)
     # end 2021-02-05 async write forb
 
     params['ngto'] = nao
+    if self.max_cond is not None:
+      from afobj.basis.opt import check_lindep
+      loop = asyncio.get_running_loop()  # keep other jobs responsive
+      with timed(timer, 'lindep'):
+        conds, ranks = await loop.run_in_executor(None, check_lindep, forb)
+      if conds.max() > self.max_cond:
+        if self.lindep_penalty is None:
+          msg = 'overlap condition number %e > %e in %s' % (
+            conds.max(), self.max_cond, path)
+          raise RuntimeError(msg)
+        if self.clean_gto_h5:
+          with timed(timer, 'cleanup'):
+            await remove_path(forb)
+        return self.lindep_penalty, None
 
     # step 2: get MP2 energy
+    if self.stage_scratch is not None:
+      with timed(timer, 'stage_outdir'):
+        params['outdir'] = await self.stage_outdir(params['outdir'])
     outdir = os.path.relpath(
       os.path.abspath(params['outdir']),
       os.path.abspath(path)
     )
     params['outdir'] = outdir
-    self.calc.set(**params)
-    self.calc.directory = path
-    await self.calc.acalc(self.atoms)
-    emp2 = self.calc.get_potential_energy()
-    if self.verbose:
-      print(self.iteration, emp2, *x, flush=True)
-      fbh5 = h5py.File(self.fband_h5, 'a')
-      evals = self.calc.results['evals']
-      dset = fbh5.create_dataset(label, data=evals)
-      fbh5.close()
+    calc = self.new_calc()
+    calc.set(**params)
+    calc.directory = path
+    calc.timer = timer
+    self.last_calc = calc
+    await calc.acalc(self.atoms)
     if self.clean_gto_h5:
-      import subprocess as sp
-      sp.check_call(['rm', forb])
-    if not keep_qe_io:
-      import subprocess as sp
-      sp.check_call(['rm', '-r', path])
-    self.iteration += 1
+      with timed(timer, 'cleanup'):
+        await remove_path(forb)
+    return calc.get_potential_energy(), calc
+
+  async def get_mp2_energy(self, x, keep_qe_io=True, iteration=None,
+    ref=None):
+    # get parameters
+    params = self.default_parameters.copy()
+    params.update(self.parameters)
+    if iteration is None:  # reserve label before any await
+      iteration = self.iteration
+      self.iteration += 1
+    key = None
+    if self.mp2_cache is not None:
+      key = self.cache_key(x, params)
+      cached = self.mp2_cache.get(key)
+      if cached is not None:
+        emp2, evals = cached
+        if self.verbose:
+          print(iteration, emp2, *x, flush=True)
+          self.record(iteration, x, emp2, evals)
+        return emp2
+    timer = None
+    if self.timing_log is not None:
+      from afobj.basis.timing import StageTimer
+      timer = StageTimer(self.timing_log, iteration=iteration)
+    try:
+      return await self.run_mp2_energy(x, keep_qe_io, iteration, params,
+        key, timer, ref)
+    finally:
+      if timer is not None:
+        timer.write()
+
+  async def run_mp2_energy(self, x, keep_qe_io, iteration, params, key,
+    timer=None, ref=None):
+    from afobj.basis.timing import timed
+    label = 'i%05d' % iteration
+    # make run directory, transient files may go to fast scratch
+    path = self.tmpdir + label
+    if self.scratch is not None:
+      with timed(timer, 'scratch_wait'):
+        path = await self.scratch.acquire(label)
+    elif not os.path.isdir(path):
+      os.mkdir(path)
+    try:
+      with timed(timer, 'total'):
+        emp2, calc = await self.compute_mp2_energy(x, path, params, timer,
+          ref)
+    finally:
+      if self.scratch is not None:
+        keep_path = self.tmpdir + label if keep_qe_io else None
+        with timed(timer, 'cleanup'):
+          await self.scratch.release(path, keep_path)
+    evals = None
+    if calc is not None:
+      evals = calc.results.get('evals', None)
+    with timed(timer, 'record'):
+      if self.verbose:
+        print(iteration, emp2, *x, flush=True)
+        self.record(iteration, x, emp2, evals)
+      if key is not None and calc is not None:
+        self.mp2_cache.put(key, emp2, evals, x)
+    if self.scratch is None and not keep_qe_io:
+      with timed(timer, 'cleanup'):
+        await remove_path(path)
     return emp2
+
+  async def get_mp2_energies(self, xs, max_concurrency=None,
+    return_exceptions=False, **kwargs):
+    """ evaluate MP2 energies of many parameter vectors concurrently
+
+    By default the first failed evaluation cancels all others, which
+    kills their QE runs, and its exception is raised.
+
+    Args:
+      xs (list): parameter vectors
+      max_concurrency (int, optional): max. number of evaluations in
+        flight, default all
+      return_exceptions (bool, optional): let all evaluations finish and
+        return exceptions in place of failed energies
+      kwargs: passed to get_mp2_energy
+    Return:
+      list: MP2 energies in the order of xs
+    """
+    # labels follow input order, whatever order evaluations finish in
+    iteration0 = self.iteration
+    self.iteration += len(xs)
+    sem = None
+    if max_concurrency is not None:
+      sem = asyncio.Semaphore(max_concurrency)
+    async def evaluate(x, iteration):
+      if sem is None:
+        return await self.get_mp2_energy(x, iteration=iteration, **kwargs)
+      async with sem:
+        return await self.get_mp2_energy(x, iteration=iteration, **kwargs)
+    tasks = [asyncio.ensure_future(evaluate(x, iteration0+i))
+      for i, x in enumerate(xs)]
+    if return_exceptions:
+      return await asyncio.gather(*tasks, return_exceptions=True)
+    try:
+      return await asyncio.gather(*tasks)
+    except BaseException:  # do not leave other evaluations running
+      for task in tasks:
+        task.cancel()
+      await asyncio.gather(*tasks, return_exceptions=True)
+      raise
+
+  async def get_mp2_gradient(self, x, rel_step=1e-3, central=True,
+    bounds=None, max_concurrency=None, incremental=True, **kwargs):
+    """ MP2 energy and finite-difference gradient, all points concurrent
+
+    With incremental=True, and a WPO_COMMAND containing REFARGS or the
+    orbital server, orbitals at x are written once to a reference
+    directory first; every point then recomputes only the shells its
+    displacement changes and copies the rest.
+
+    Args:
+      x (np.array): parameters
+      rel_step (float, optional): step relative to |x|, default 1e-3
+      central (bool, optional): 2N+1 (central) or N+1 (forward) points
+      bounds (list, optional): (lo, hi) per parameter, see opt.fd_points
+      max_concurrency (int, optional): passed to get_mp2_energies
+      incremental (bool, optional): reuse orbitals at x, default True
+    Return:
+      (float, np.array): energy at x and its gradient
+    """
+    import numpy as np
+    from afobj.basis.opt import fd_steps, fd_points, fd_gradient
+    x = np.array(x, dtype=float)
+    steps = fd_steps(x, rel_step)
+    xs, signs = fd_points(x, steps, central=central, bounds=bounds)
+    ref = None
+    if incremental and self.incremental_orbitals():
+      ref = await self.write_reference(x, 'r%05d' % self.iteration)
+    try:
+      es = await self.get_mp2_energies([x]+xs,
+        max_concurrency=max_concurrency, ref=ref, **kwargs)
+    finally:
+      if ref is not None:
+        await remove_path(ref)
+    grad = fd_gradient(es[0], es[1:], steps, signs)
+    return es[0], grad
@@ -1,4 +1,5 @@
 import numpy as np
+from collections import OrderedDict
 
 def get_pw_kvecs(raxes, kc, kpt, nsh=5, kmin=1e-3):
   from qharv.inspect import axes_pos
@@ -17,62 +18,555 @@ def find_pw_kvecs(kvecs, raxes, kpt):
   assert np.allclose(gvecs, gcands)
   return gvecs
 
-def write_esh5_orbitals(cell, name, kpts, kc=None):
+def pw_index(gvecs, mesh):
+  """ flat indices of G-vectors on the FFT grid in QE (2,1,0) order
+
+  Args:
+    gvecs (np.array): integer G-vectors, e.g. from find_pw_kvecs
+    mesh (array-like): FFT mesh, shape (3,)
+  Return:
+    np.array: flat grid indices, shape (len(gvecs),)
+  """
+  gvecs = np.asarray(gvecs, dtype=int).reshape(-1, 3)
+  n0, n1, n2 = mesh
+  return ((gvecs[:, 2] % n2)*n1 + gvecs[:, 1] % n1)*n0 + gvecs[:, 0] % n0
+
+def pw_orbitals(idx, nnr):
+  """ expand PW states stored as flat grid indices to dense orbitals """
+  aoG = np.zeros((len(idx), nnr), dtype=complex)
+  aoG[np.arange(len(idx)), idx] = 1
+  return aoG
+
+def write_pw_orbitals(grp, ik, idx, nnr, slab=None):
+  """ write dense PW states one grid element at a time
+
+  Unwritten elements come from the HDF5 fill value, so no dense mesh is
+  ever built in memory.
+
+  Args:
+    grp (h5py.Group): OrbsG group
+    ik (int): kpoint index
+    idx (np.array): flat grid indices from pw_index
+    nnr (int): number of grid points
+    slab (h5py.Dataset, optional): write into the first rows of this
+      kpoint slab rather than one kp{ik}_b{ipw} dataset per PW
+  """
+  for ipw, i in enumerate(idx):
+    if slab is None:
+      dset = grp.create_dataset('kp%d_b%d' % (ik, ipw), shape=(nnr, 2),
+        dtype=np.float64, fillvalue=0)
+      dset[i, 0] = 1.0
+    else:
+      slab[ipw, i, 0] = 1.0
+
+def time_reversal_pairs(kpts, raxes, tol=1e-6):
+  """ find kpoints that are time-reversal partners of an earlier kpoint
+
+  Args:
+    kpts (np.array): kpoints, shape (nk, 3)
+    raxes (np.array): reciprocal lattice vectors, shape (3, 3)
+    tol (float, optional): tolerance on the fractional G0
+  Return:
+    dict: {j: (i, g0)} with i<j and kpts[j] = -kpts[i] + g0 @ raxes
+  """
+  inv_raxes = np.linalg.inv(raxes)
+  pairs = {}
+  for j in range(len(kpts)):
+    for i in range(j):
+      if i in pairs:  # partner of a partner
+        continue
+      gfrac = np.dot(kpts[i]+kpts[j], inv_raxes)
+      g0 = np.around(gfrac).astype(int)
+      if np.allclose(gfrac, g0, atol=tol):
+        pairs[j] = (i, g0)
+        break
+  return pairs
+
+def time_reversal_index(mesh, g0=(0, 0, 0)):
+  """ grid permutation taking orbitals at k to -k+G0 in QE order
+
+  For real AOs c_{-k+G0}(G) = conj(c_k(-G-G0)), so the partner orbitals
+  are aoG[:, idx].conj().
+
+  Args:
+    mesh (array-like): FFT mesh, shape (3,)
+    g0 (array-like, optional): integer reciprocal lattice vector
+  Return:
+    np.array: flat grid indices, shape (prod(mesh),)
+  """
+  n0, n1, n2 = mesh
+  m0, m1, m2 = [(-np.arange(n)-g) % n for n, g in zip(mesh, g0)]
+  idx = (m2[:, np.newaxis, np.newaxis]*n1 + m1[np.newaxis, :, np.newaxis])*n0
+  return (idx + m0[np.newaxis, np.newaxis, :]).ravel()
+
+def fft_orbitals(ao, fac, mesh):
+  """ FFT a block of AOs to reciprocal space in QE grid order
+
+  Args:
+    ao (np.array): AOs on the real-space grid, shape (ngrid, nblk)
+    fac (np.array): Bloch phase exp(-ik.r) on the grid, shape (ngrid,)
+    mesh (array-like): FFT mesh, shape (3,)
+  Return:
+    np.array: complex orbitals, shape (nblk, ngrid)
+  """
+  from pyscf.pbc import tools
+  nblk = ao.shape[1]
+  aoi = np.asarray((fac[:, np.newaxis]*ao).T, order='C')
+  aoi_G = tools.fft(aoi, mesh).reshape(nblk, *mesh)
+  return aoi_G.transpose(0, 3, 2, 1).reshape(nblk, -1)
+
+def hermitian_expand(half, mesh):
+  """ expand rfftn output over the last three axes to the full FFT
+
+  Uses c(G) = conj(c(-G)) for the missing half of the last axis.
+
+  Args:
+    half (np.array): shape (..., n0, n1, n2//2+1)
+    mesh (array-like): FFT mesh (n0, n1, n2)
+  Return:
+    np.array: shape (..., n0, n1, n2)
+  """
+  n0, n1, n2 = mesh
+  nh = half.shape[-1]
+  full = np.empty(half.shape[:-1]+(n2,), dtype=complex)
+  full[..., :nh] = half
+  if n2 > nh:
+    m0 = (-np.arange(n0)) % n0
+    m1 = (-np.arange(n1)) % n1
+    m2 = n2-np.arange(nh, n2)
+    neg = half[..., m0, :, :][..., m1, :][..., m2]
+    full[..., nh:] = neg.conj()
+  return full
+
+def rfft_orbitals(ao, mesh):
+  """ real-to-complex FFT of a block of real Gamma-point AOs
+
+  Same output as fft_orbitals(ao, 1, mesh) with half the FFT work and
+  memory; the Hermitian half is only filled in at the end.
+
+  Args:
+    ao (np.array): real AOs on the real-space grid, shape (ngrid, nblk)
+    mesh (array-like): FFT mesh, shape (3,)
+  Return:
+    np.array: complex orbitals, shape (nblk, ngrid)
+  """
+  nblk = ao.shape[1]
+  aoi = np.asarray(ao.T, order='C').reshape(nblk, *mesh)
+  aoi_G = hermitian_expand(np.fft.rfftn(aoi, axes=(1, 2, 3)), mesh)
+  return aoi_G.transpose(0, 3, 2, 1).reshape(nblk, -1)
+
+def ft_orbitals(cell, Gv, kpt, shls_slice=None):
+  """ analytic Fourier transform of AOs in QE grid order
+
+  Same normalization as fft_orbitals. The two agree to the aliasing error
+  of the real-space grid: <1e-7 relative once cell.mesh resolves the
+  tightest Gaussian, ~1e-2 on a mesh that under-resolves it.
+
+  Args:
+    cell (pyscf.pbc.gto.Cell): cell with basis
+    Gv (np.array): G-vectors in FFT order, i.e. cell.get_Gv(cell.mesh)
+    kpt (np.array): kpoint, shape (3,)
+    shls_slice (tuple, optional): (shell start, shell end), default all
+  Return:
+    np.array: complex orbitals, shape (nao, ngrid)
+  """
+  from pyscf.pbc.df import ft_ao
+  ngrid = len(Gv)
+  aoG = ft_ao.ft_ao(cell, Gv, shls_slice=shls_slice, kpt=kpt).T
+  aoG = (ngrid/cell.vol)*aoG.reshape(-1, *cell.mesh)
+  return aoG.transpose(0, 3, 2, 1).reshape(len(aoG), ngrid)
+
+def shell_blocks(cell, nblk=None, mask=None):
+  """ group consecutive shells into blocks of at most nblk AOs
+
+  A shell larger than nblk gets a block of its own.
+
+  Args:
+    cell (pyscf.pbc.gto.Cell): cell with basis
+    nblk (int, optional): max. number of AOs per block, default all
+    mask (np.array, optional): only group shells where mask is True
+  Return:
+    list: (shell start, shell end, AO start, AO end) for each block
+  """
+  ao_loc = [int(i) for i in cell.ao_loc_nr()]
+  if nblk is None:
+    nblk = ao_loc[-1]
+  if mask is None:
+    mask = np.ones(cell.nbas, dtype=bool)
+  blocks = []
+  sh0 = None
+  for sh in range(cell.nbas):
+    if sh0 is not None and (not mask[sh] or ao_loc[sh+1]-ao_loc[sh0] > nblk):
+      blocks.append((sh0, sh, ao_loc[sh0], ao_loc[sh]))
+      sh0 = None
+    if mask[sh] and sh0 is None:
+      sh0 = sh
+  if sh0 is not None:
+    blocks.append((sh0, cell.nbas, ao_loc[sh0], ao_loc[cell.nbas]))
+  return blocks
+
+def changed_shells(cell, ref_cell):
+  """ find shells whose exponents or contractions differ from ref_cell
+
+  Args:
+    cell (pyscf.pbc.gto.Cell): cell with basis
+    ref_cell (pyscf.pbc.gto.Cell): reference cell, e.g. previous x
+  Return:
+    np.array: bool mask over shells, None if atoms or shell structure
+     (atom, l, nprim, nctr of each shell) differ
+  """
+  if cell.nbas != ref_cell.nbas or cell.natm != ref_cell.natm:
+    return None
+  if not np.allclose(cell.atom_coords(), ref_cell.atom_coords()):
+    return None
+  changed = np.zeros(cell.nbas, dtype=bool)
+  for ib in range(cell.nbas):
+    for attr in ['bas_atom', 'bas_angular', 'bas_nprim', 'bas_nctr']:
+      if getattr(cell, attr)(ib) != getattr(ref_cell, attr)(ib):
+        return None
+    same = np.array_equal(cell.bas_exp(ib), ref_cell.bas_exp(ib)) and \
+      np.array_equal(cell._libcint_ctr_coeff(ib),
+        ref_cell._libcint_ctr_coeff(ib))
+    changed[ib] = not same
+  return changed
+
+def link_kpoint_orbitals(grp, ik, virtual=True):
+  """ add per-orbital kp{ik}_b{i} datasets, as QE expects, to a kpoint slab
+
+  Args:
+    grp (h5py.Group): OrbsG group containing kp{ik}_orbs
+    ik (int): kpoint index
+    virtual (bool, optional): use virtual datasets into the slab (no extra
+      storage, needs HDF5>=1.10 in the reader) rather than copies
+  """
   import h5py
+  slab = grp['kp%d_orbs' % ik]
+  norb = slab.shape[0]
+  off = 0  # sparse PW states are not in the slab
+  if 'kp%d_pw_index' % ik in grp:
+    off = len(grp['kp%d_pw_index' % ik])
+  for iorb in range(norb):
+    name = 'kp%d_b%d' % (ik, off+iorb)
+    if name in grp:  # already linked
+      continue
+    if virtual:
+      layout = h5py.VirtualLayout(shape=slab.shape[1:], dtype=slab.dtype)
+      layout[:] = h5py.VirtualSource('.', slab.name, shape=slab.shape)[iorb]
+      grp.create_virtual_dataset(name, layout)
+    else:
+      grp.create_dataset(name, data=slab[iorb])
+
+def write_orbital_links(fname, virtual=True):
+  """ add QE per-orbital names to a layout='kpoint' or pw_sparse file """
+  import h5py
+  with h5py.File(fname, 'a') as fh5:
+    grp = fh5['OrbsG']
+    nkpts = int(grp['number_of_kpoints'][()])
+    nnr = int(np.prod(grp['fft_grid'][()]))
+    for ik in range(nkpts):
+      name = 'kp%d_pw_index' % ik
+      if name in grp:
+        if 'kp%d_b0' % ik not in grp:
+          write_pw_orbitals(grp, ik, grp[name][()], nnr)
+      if 'kp%d_orbs' % ik in grp:
+        link_kpoint_orbitals(grp, ik, virtual=virtual)
+
+def read_orbital_rows(grp, ik, i0, i1):
+  """ read orbitals i0:i1 at one kpoint from either orbital layout
+
+  Args:
+    grp (h5py.Group): OrbsG group
+    ik (int): kpoint index
+    i0 (int): first orbital
+    i1 (int): one past the last orbital
+  Return:
+    np.array: complex orbitals, shape (i1-i0, ngrid)
+  """
+  # fft_grid is only needed to expand PWs, QE-written files may lack it
+  npw = 0  # PW states stored sparse are expanded here
+  if 'kp%d_pw_index' % ik in grp:
+    idx = grp['kp%d_pw_index' % ik][()]
+    npw = len(idx)
+  orbl = []
+  if i0 < npw:
+    nnr = int(np.prod(grp['fft_grid'][()]))
+    orbl.append(pw_orbitals(idx[i0:i1], nnr))
+  j0 = max(i0, npw)
+  if j0 < i1:
+    name = 'kp%d_orbs' % ik
+    if name in grp:  # one slab read
+      carr = grp[name][j0-npw:i1-npw]
+    else:
+      carr = np.array([grp['kp%d_b%d' % (ik, iorb)][()]
+        for iorb in range(j0, i1)])
+    orbl.append(carr[..., 0] + 1j*carr[..., 1])
+  if len(orbl) < 1:
+    nnr = int(np.prod(grp['fft_grid'][()]))
+    return np.zeros((0, nnr), dtype=complex)
+  return np.concatenate(orbl, axis=0)
+
+def read_kpoint_orbitals(grp, ik, norb=None):
+  """ read all orbitals at one kpoint from either orbital layout
+
+  Args:
+    grp (h5py.Group): OrbsG group
+    ik (int): kpoint index
+    norb (int, optional): number of orbitals, default all
+  Return:
+    np.array: complex orbitals, shape (norb, ngrid)
+  """
+  if norb is None:
+    norb = grp['number_of_orbitals'][()][ik]
+  return read_orbital_rows(grp, ik, 0, norb)
+
+def kpoint_gtos(cell, kpt, nblk=None, analytic=False, rfft=True,
+  blocks=None, timer=None, ik=None):
+  """ generate GTO orbitals at one kpoint in blocks of at most nblk
+
+  Args:
+    cell (pyscf.pbc.gto.Cell): cell with basis
+    kpt (np.array): kpoint, shape (3,)
+    nblk (int, optional): max. number of AOs per block, default all
+    analytic (bool, optional): use ft_orbitals rather than fft_orbitals
+    rfft (bool, optional): at Gamma, use real AOs and rfft_orbitals
+    blocks (list, optional): shell blocks to compute, default all
+    timer (StageTimer, optional): time AO evaluation and FFTs, tagged ik
+    ik (int, optional): kpoint index for timer
+  Return:
+    generator: (first AO index, complex orbitals (nblk, ngrid)) pairs
+  """
   from pyscf.pbc.dft import numint
-  from pyscf.pbc import tools
+  from afobj.basis.timing import timed
+  gamma = rfft and np.allclose(kpt, 0)
+  if analytic:  # Fourier transform GTOs directly on the G-vectors
+    Gv = cell.get_Gv(cell.mesh)
+  else:
+    coords = cell.gen_uniform_grids(cell.mesh)
+    if not gamma:
+      fac = np.exp(-1j * np.dot(coords, kpt))
+  if blocks is None:
+    blocks = shell_blocks(cell, nblk)
+  for sh0, sh1, i0, i1 in blocks:
+    if analytic:
+      with timed(timer, 'ft_ao', ik=ik):
+        aoG = ft_orbitals(cell, Gv, kpt, shls_slice=(sh0, sh1))
+    elif gamma:  # no Bloch phase, AOs are real
+      with timed(timer, 'eval_ao', ik=ik):
+        ao = numint.NumInt().eval_ao(cell, coords, shls_slice=(sh0, sh1))
+      with timed(timer, 'fft', ik=ik):
+        aoG = rfft_orbitals(ao, cell.mesh)
+      del ao
+    else:
+      with timed(timer, 'eval_ao', ik=ik):
+        ao = numint.KNumInt().eval_ao(cell, coords, kpt,
+          shls_slice=(sh0, sh1))[0]
+      with timed(timer, 'fft', ik=ik):
+        aoG = fft_orbitals(ao, fac, cell.mesh)
+      del ao
+    yield i0, aoG
+
+def _kpoint_gtos_task(cell, kpt, blocks, analytic, rfft):
+  # pool worker: GTO blocks at one kpoint, handed back to the single writer
+  if isinstance(cell, str):  # Cell does not pickle, ship it serialized
+    from pyscf.pbc import gto
+    cell = gto.loads(cell)
+  return list(kpoint_gtos(cell, kpt, analytic=analytic, rfft=rfft,
+    blocks=blocks))
+
+def _init_pool_worker(nthread):
+  from pyscf import lib
+  lib.num_threads(nthread)
+
+def write_esh5_orbitals(cell, name, kpts, kc=None, nblk=None,
+  analytic=False, stream=False, layout='orbital', links=True,
+  nworker=1, pool='process', pw_sparse=False, time_reversal=False,
+  rfft=True, ref_h5=None, changed=None, timer=None):
+  """ write orbitals in the OrbsG format read by QE
+
+  layout='orbital' stores one kp{ik}_b{i} dataset per orbital. With
+  layout='kpoint' each kpoint is one chunked (norb, ngrid, 2) dataset
+  kp{ik}_orbs, and links=True adds virtual kp{ik}_b{i} views into it.
+
+  nworker>1 computes kpoints concurrently in a 'process' or 'thread' pool
+  while this process alone writes the file. Each worker returns all GTOs
+  of its kpoint at once, so up to nworker+1 whole kpoints are held in
+  memory (nworker in flight, one being written) regardless of nblk.
+
+  PW states from kc are written element-wise without dense meshes. With
+  pw_sparse=True they are only stored as flat grid indices kp{ik}_pw_index;
+  read_kpoint_orbitals expands them and write_orbital_links makes them
+  readable by QE.
+
+  time_reversal=True evaluates GTOs only at one kpoint of each -k+G0
+  pair; the partner is read back from the file blockwise, permuted and
+  conjugated. Assumes real AOs, as pyscf uses. This is exact with FFTs;
+  with analytic=True the Nyquist planes of an even mesh differ, within
+  the aliasing tolerance of ft_orbitals.
+
+  At Gamma, rfft=True evaluates real AOs and uses real-to-complex FFTs,
+  expanding the Hermitian half only for writing (agrees with the complex
+  path to ~1e-14).
+
+  Given a reference file ref_h5 written with the same kpoints, mesh and
+  kc, and the changed_shells mask of cell against the reference cell,
+  only the changed shells are recomputed; all other GTOs are copied.
+
+  timer (timing.StageTimer) records per-kpoint stages: kpoint (total),
+  pw, eval_ao and fft or ft_ao, and write (HDF5 writes of GTO blocks).
+  AO and FFT stages are not recorded for kpoints computed in a worker
+  pool.
+  """
+  import os
+  import h5py
+  from heapq import merge
+  from afobj.basis.timing import timed
   def to_qmcpack_complex(array):
+    array = np.ascontiguousarray(array)
     shape = array.shape
     return array.view(np.float64).reshape(shape+(2,))
-  ngto = cell.nao_nr()
-
-  fh5 = h5py.File(name, 'w')
-  coords = cell.gen_uniform_grids(cell.mesh)
-  
-  kpts = np.asarray(kpts)
-  nkpts = len(kpts)
-  norbs = np.zeros((nkpts,),dtype=int)
-  norbs[:] = ngto
-
-  grp = fh5.create_group("OrbsG")
-  dset = grp.create_dataset("reciprocal_vectors", data=cell.reciprocal_vectors())
-  dset = grp.create_dataset("number_of_kpoints", data=len(kpts))
-  dset = grp.create_dataset("kpoints", data=kpts)
-  dset = grp.create_dataset("fft_grid", data=cell.mesh)
-  dset = grp.create_dataset("grid_type", data=int(0))
-  nnr = cell.mesh[0]*cell.mesh[1]*cell.mesh[2]
-  # loop over kpoints later
-  aol = []
-  for (ik,k) in enumerate(kpts):
-    # add PW states first
-    npw = 0
-    if kc is not None:
-      raxes = cell.reciprocal_vectors()
-      kvecs = get_pw_kvecs(raxes, kc, k)
-      gvecs = find_pw_kvecs(kvecs, raxes, k)
-      for g in gvecs:
-        aoi_G = np.zeros(cell.mesh, dtype=complex)
-        aoi_G[tuple(g)] = 1
-        aoi_G = aoi_G.transpose(2,1,0).reshape(nnr)
-        aol.append(aoi_G)
-        dset = grp.create_dataset('kp'+str(ik)+'_b'+str(npw),
+  def write_block(ik, i0, aoG, off=0):
+    if layout == 'kpoint':  # slab rows start after the off sparse PWs
+      grp['kp%d_orbs' % ik][i0-off:i0-off+len(aoG)] = to_qmcpack_complex(aoG)
+    else:
+      for i, aoi_G in enumerate(aoG):
+        dset = grp.create_dataset('kp'+str(ik)+'_b'+str(i0+i),
           data=to_qmcpack_complex(aoi_G)
         )
-        npw += 1
-    # now add GTOs
-    ao = numint.KNumInt().eval_ao(cell, coords, k)[0]
-    fac = np.exp(-1j * np.dot(coords, k))
-    for i in range(norbs[ik]):
-      aoi = fac * np.asarray(ao[:,i].T, order='C')
-      aoi_G = tools.fft(aoi, cell.mesh)
-      aoi_G = aoi_G.reshape(cell.mesh).transpose(2,1,0).reshape(nnr)
-      aol.append(aoi_G)
-      dset = grp.create_dataset('kp'+str(ik)+'_b'+str(i+npw),
-        data=to_qmcpack_complex(aoi_G)
-      )
-    norbs[ik] += npw
-  dset = grp.create_dataset("number_of_orbitals", data=norbs)
-  fh5.close()
+  if layout not in ['orbital', 'kpoint']:
+    msg = 'unknown layout "%s"' % layout
+    raise RuntimeError(msg)
+  ngto = cell.nao_nr()
+  blocks = shell_blocks(cell, nblk)
+  copy_blocks = []
+  rh5 = None
+  fh5 = None
+  executor = None
+  try:
+    if ref_h5 is not None and changed is not None:
+      if os.path.abspath(ref_h5) == os.path.abspath(name):
+        msg = 'cannot update "%s" in place' % name
+        raise RuntimeError(msg)
+      rh5 = h5py.File(ref_h5, 'r')
+      rgrp = rh5['OrbsG']
+      same = len(rgrp['kpoints']) == len(kpts) and \
+        np.allclose(rgrp['kpoints'][()], kpts) and \
+        np.array_equal(rgrp['fft_grid'][()], cell.mesh)
+      if not same:
+        msg = '%s has different kpoints or mesh' % ref_h5
+        raise RuntimeError(msg)
+      rnorbs = rgrp['number_of_orbitals'][()]
+      blocks = shell_blocks(cell, nblk, mask=changed)
+      copy_blocks = shell_blocks(cell, nblk, mask=~changed)
+
+    fh5 = h5py.File(name, 'w')
+
+    kpts = np.asarray(kpts)
+    nkpts = len(kpts)
+    norbs = np.zeros((nkpts,),dtype=int)
+    norbs[:] = ngto
+    pairs = {}
+    if time_reversal:
+      pairs = time_reversal_pairs(kpts, cell.reciprocal_vectors())
+    src = [ik for ik in range(nkpts) if ik not in pairs]
+    if nworker > 1 and len(src) > 0:
+      from collections import deque
+      from concurrent import futures
+      nworker = min(nworker, len(src))
+      wcell = cell
+      if pool == 'process':
+        wcell = cell.dumps()
+        nthread = max(1, len(os.sched_getaffinity(0))//nworker)
+        executor = futures.ProcessPoolExecutor(nworker,
+          initializer=_init_pool_worker, initargs=(nthread,))
+      elif pool == 'thread':
+        executor = futures.ThreadPoolExecutor(nworker)
+      else:
+        msg = 'unknown pool "%s"' % pool
+        raise RuntimeError(msg)
+      # results are taken in kpoint order, nworker kpoints in flight
+      todo = iter(src)
+      inflight = deque()
+      def submit():
+        ik = next(todo, None)
+        if ik is not None:
+          inflight.append(executor.submit(_kpoint_gtos_task, wcell, kpts[ik],
+            blocks, analytic, rfft))
+      for i in range(nworker):
+        submit()
+
+    grp = fh5.create_group("OrbsG")
+    dset = grp.create_dataset("reciprocal_vectors", data=cell.reciprocal_vectors())
+    dset = grp.create_dataset("number_of_kpoints", data=len(kpts))
+    dset = grp.create_dataset("kpoints", data=kpts)
+    dset = grp.create_dataset("fft_grid", data=cell.mesh)
+    dset = grp.create_dataset("grid_type", data=int(0))
+    nnr = cell.mesh[0]*cell.mesh[1]*cell.mesh[2]
+    # loop over kpoints later
+    aol = []
+    for (ik,k) in enumerate(kpts):
+      with timed(timer, 'kpoint', ik=ik):
+        gvecs = []
+        if kc is not None:
+          raxes = cell.reciprocal_vectors()
+          kvecs = get_pw_kvecs(raxes, kc, k)
+          gvecs = find_pw_kvecs(kvecs, raxes, k)
+        npw = len(gvecs)
+        off = npw if pw_sparse else 0
+        slab = None
+        if layout == 'kpoint':
+          slab = grp.create_dataset('kp%d_orbs' % ik,
+            shape=(npw-off+ngto, nnr, 2), dtype=np.float64, chunks=(1, nnr, 2))
+        # add PW states first
+        if npw > 0:
+          with timed(timer, 'pw', ik=ik):
+            idx = pw_index(gvecs, cell.mesh)
+            if pw_sparse:
+              dset = grp.create_dataset('kp%d_pw_index' % ik, data=idx)
+            else:
+              write_pw_orbitals(grp, ik, idx, nnr, slab=slab)
+            if not stream:
+              aol.extend(pw_orbitals(idx, nnr))
+        # now add GTOs
+        if ik in pairs:
+          isrc, g0 = pairs[ik]
+          npw0 = norbs[isrc]-ngto
+          idx = time_reversal_index(cell.mesh, g0)
+          gtos = ((i0, read_orbital_rows(grp, isrc, npw0+i0, npw0+i1)[:, idx].conj())
+            for sh0, sh1, i0, i1 in shell_blocks(cell, nblk))
+        else:
+          if executor is not None:
+            gtos = inflight.popleft().result()
+            submit()
+          else:  # at most nblk GTOs are held at a time
+            gtos = kpoint_gtos(cell, k, analytic=analytic, rfft=rfft,
+              blocks=blocks, timer=timer, ik=ik)
+          if len(copy_blocks) > 0:  # unchanged shells from the reference
+            rnpw = rnorbs[ik]-ngto
+            if rnpw != npw:
+              msg = '%s has %d PWs at kpoint %d, not %d' % (ref_h5, rnpw, ik, npw)
+              raise RuntimeError(msg)
+            copied = ((i0, read_orbital_rows(rgrp, ik, npw+i0, npw+i1))
+              for sh0, sh1, i0, i1 in copy_blocks)
+            gtos = merge(gtos, copied, key=lambda blk: blk[0])
+        for i0, aoG in gtos:
+          if not stream:
+            aol.extend(aoG)
+          with timed(timer, 'write', ik=ik):
+            write_block(ik, npw+i0, aoG, off=off)
+          del aoG
+        norbs[ik] += npw
+        if layout == 'kpoint' and links:
+          link_kpoint_orbitals(grp, ik)
+    dset = grp.create_dataset("number_of_orbitals", data=norbs)
+  finally:
+    if executor is not None:
+      executor.shutdown(cancel_futures=True)
+    if fh5 is not None:
+      fh5.close()
+    if rh5 is not None:
+      rh5.close()
+  if stream:  # orbitals are only on disk
+    return norbs
   return np.array(aol)
 
 def gen_cell_no_basis(atoms):
@@ -81,46 +575,103 @@ def gen_cell_no_basis(atoms):
   cell.from_ase(atoms)
   return cell
 
-def gen_cell(atoms, bset, x, mesh=None, prec=1e-12, verbose=0):
+# LRU cache of built cells for gen_cell, parameter-independent pseudo
+#  potentials are kept separately so new exponents skip loading them
+CELL_CACHE_SIZE = 16
+_cell_cache = OrderedDict()
+_pseudo_cache = {}
+
+def clear_cell_cache():
+  _cell_cache.clear()
+  _pseudo_cache.clear()
+
+def gen_cell(atoms, bset, x, mesh=None, prec=1e-12, verbose=0, cache=True):
+  """ build a pyscf Cell with the basis of bset at parameters x
+
+  With cache=True, cells are reused across calls with the same geometry,
+  mesh, precision and per-element basis, keeping the CELL_CACHE_SIZE most
+  recently used. Cached cells are shared, so do not modify them.
+  """
   from pyscf import gto as molgto
   from pyscf.pbc.gto import Cell
   # extract info from ase atoms
-  axes = atoms.get_cell()
+  axes = np.array(atoms.cell.array)
   elem = atoms.get_chemical_symbols()
   pos = atoms.get_positions()
+  atext = ''
+  for name, r in zip(elem, pos):
+    atext += '%s %.6f %.6f %.6f\n' % (name, *r)
+  # basis text once per element
+  bstrs = {}
+  for atm in elem:
+    if atm in bstrs:
+      continue
+    if type(x) is str:  # no need for bset
+      bstrs[atm] = load_element(atm, x)
+    else:
+      bstrs[atm] = bset.basis_str(atm, x)
+  mkey = None if mesh is None else tuple(int(n) for n in mesh)
+  pkey = tuple(sorted(bstrs))
+  key = (axes.tobytes(), atext, mkey, prec, verbose,
+    tuple(sorted(bstrs.items())))
+  if cache and key in _cell_cache:
+    _cell_cache.move_to_end(key)
+    return _cell_cache[key]
   cell = Cell()
   cell.verbose = verbose  # shut the cell up
   cell.units = 'A'
   cell.precision = prec
   cell.a = axes
-  atext = ''
-  for name, r in zip(elem, pos):
-    atext += '%s %.6f %.6f %.6f\n' % (name, *r)
   cell.atom = atext
   cell.pseudo = 'gthpbe'  # !!!! wut
+  if cache and pkey in _pseudo_cache:  # already parsed
+    cell.pseudo = _pseudo_cache[pkey]
   if mesh is not None:
     cell.mesh = mesh
   # build basis
   basis = {}
-  for atm in elem:
-    if type(x) is str:  # no need for bset
-      bstr = load_element(atm, x)
-    else:
-      bstr = bset.basis_str(atm, x)
+  for atm, bstr in bstrs.items():
     basis.update({atm: molgto.parse(bstr)})
   cell.basis = basis
   cell.build()
+  if cache:
+    _pseudo_cache[pkey] = cell._pseudo
+    _cell_cache[key] = cell
+    while len(_cell_cache) > CELL_CACHE_SIZE:
+      _cell_cache.popitem(last=False)
   return cell
 
 def gen_qe_gto(atoms, bset, x, kpts, fname='pyscf.orbitals.h5',
-  mesh=None, prec=1e-12, kc=None, verbose=0):
+  mesh=None, prec=1e-12, kc=None, nblk=None, analytic=False,
+  layout='orbital', nworker=1, pool='process', pw_sparse=False,
+  time_reversal=False, rfft=True, ref_x=None, ref_fname=None, verbose=0,
+  timer=None):
+  """ write GTO (and optionally PW) orbitals for QE, return total count
+
+  Orbitals are streamed to fname in blocks of at most nblk AOs, so peak
+  memory is ~3*nblk*prod(mesh)*16 bytes rather than all orbitals at
+  all kpoints.
+
+  Given the parameters ref_x of an existing orbital file ref_fname, only
+  orbitals of shells changed from ref_x are recomputed (incremental mode);
+  a different shell structure falls back to a full rebuild.
+  """
+  from afobj.basis.timing import timed
   if type(x) is not str:
     assert(len(x) == bset.number_of_params)
-  cell = gen_cell(atoms, bset, x, mesh=mesh, prec=prec, verbose=verbose)
+  with timed(timer, 'gen_cell'):
+    cell = gen_cell(atoms, bset, x, mesh=mesh, prec=prec, verbose=verbose)
   #nao = cell.nao_nr()
-  aos = write_esh5_orbitals(cell, fname, kpts=kpts, kc=kc)
-  #return aos
-  return len(aos)
+  changed = None
+  if ref_fname is not None and ref_x is not None:
+    ref_cell = gen_cell(atoms, bset, ref_x, mesh=mesh, prec=prec,
+      verbose=verbose)
+    changed = changed_shells(cell, ref_cell)
+  norbs = write_esh5_orbitals(cell, fname, kpts=kpts, kc=kc, nblk=nblk,
+    analytic=analytic, stream=True, layout=layout, nworker=nworker,
+    pool=pool, pw_sparse=pw_sparse, time_reversal=time_reversal, rfft=rfft,
+    ref_h5=ref_fname, changed=changed, timer=timer)
+  return int(norbs.sum())
 
 def load_element(symb, ftxt):
   text = ''
@@ -0,0 +1,170 @@
+import os
+import time
+import numpy as np
+
+def loose_parameters(parameters, eigcut_scale=10., nextracut_scale=10.):
+  """ cheap MP2 settings derived from production QEMP2 parameters
+
+  Coarser FFT meshes need a separate SCF, i.e. a QEGTO with its own
+  outdir and mesh parameters; that QEGTO can be passed to MultiFidelity
+  directly.
+
+  Args:
+    parameters (dict): production parameters of QEGTO
+    eigcut_scale (float, optional): multiply eigcut, default 10
+    nextracut_scale (float, optional): multiply nextracut, default 10
+  Return:
+    dict: low-fidelity parameters
+  """
+  from afobj.basis.qemp2 import QEMP2
+  params = dict(parameters)
+  for key, scale in zip(['eigcut', 'nextracut'],
+    [eigcut_scale, nextracut_scale]):
+    val = params.get(key, QEMP2.default_parameters[key])
+    params[key] = val*scale
+  return params
+
+def correlation(elow, ehigh):
+  """ Pearson and Spearman correlation of paired energies
+
+  Return:
+    (float, float): (pearson, spearman), nan if fewer than 3 pairs
+  """
+  elow = np.asarray(elow, dtype=float)
+  ehigh = np.asarray(ehigh, dtype=float)
+  sel = np.isfinite(elow) & np.isfinite(ehigh)
+  if sel.sum() < 3:
+    return np.nan, np.nan
+  from scipy.stats import pearsonr, spearmanr
+  pearson = pearsonr(elow[sel], ehigh[sel])[0]
+  spearman = spearmanr(elow[sel], ehigh[sel])[0]
+  return pearson, spearman
+
+class MultiFidelity:
+  """ screen candidates with a cheap QEGTO, promote the best to production
+
+  Example:
+    low = QEGTO(atoms, bset, loose_parameters(params), tmpdir='low/',
+      fband_h5='low.h5')
+    high = QEGTO(atoms, bset, params, tmpdir='high/', fband_h5='high.h5')
+    mf = MultiFidelity(low, high, npromote=2)
+    ret = await mf.screen(xs)
+    print(mf.report())
+  """
+
+  def __init__(self, low, high, npromote=1, margin=None, max_concurrency=None):
+    """
+    Args:
+      low (QEGTO): low-fidelity evaluator
+      high (QEGTO): production evaluator
+      npromote (int, optional): always promote this many lowest candidates
+      margin (float, optional): also promote candidates within margin (Ha)
+        of the lowest low-fidelity energy
+      max_concurrency (int, optional): passed to get_mp2_energies
+    """
+    # both count iterations from 0, shared names would overwrite runs
+    for name in ['tmpdir', 'fband_h5']:
+      if os.path.abspath(getattr(low, name)) == \
+        os.path.abspath(getattr(high, name)):
+        msg = 'low and high share %s "%s"' % (name, getattr(low, name))
+        raise RuntimeError(msg)
+    self.low = low
+    self.high = high
+    self.npromote = npromote
+    self.margin = margin
+    self.max_concurrency = max_concurrency
+    self.nlow = 0
+    self.nhigh = 0  # promoted candidates only
+    self.tlow = 0.  # wall time of low-fidelity batches
+    self.thigh = 0.
+    self.nseed = 0  # production runs of run() starting points
+    self.tseed = 0.
+    self.pairs = []  # (elow, ehigh) of promoted candidates
+    self.best = None  # (ehigh, x)
+
+  def select(self, elow):
+    elow = np.asarray(elow, dtype=float)
+    order = np.argsort(elow)
+    keep = list(order[:self.npromote])
+    if self.margin is not None:
+      emin = elow[order[0]]
+      for i in order[self.npromote:]:
+        if elow[i] - emin <= self.margin:
+          keep.append(i)
+    return sorted(keep)
+
+  async def screen(self, xs):
+    """ evaluate all xs at low fidelity, promising ones at high fidelity
+
+    Return:
+      dict: elow, ehigh (nan if not promoted), promoted indices
+    """
+    tstart = time.perf_counter()
+    elow = await self.low.get_mp2_energies(xs,
+      max_concurrency=self.max_concurrency)
+    self.tlow += time.perf_counter() - tstart
+    self.nlow += len(xs)
+    idx = self.select(elow)
+    tstart = time.perf_counter()
+    eprom = await self.high.get_mp2_energies([xs[i] for i in idx],
+      max_concurrency=self.max_concurrency)
+    self.thigh += time.perf_counter() - tstart
+    self.nhigh += len(idx)
+    ehigh = np.full(len(xs), np.nan)
+    for i, e in zip(idx, eprom):
+      ehigh[i] = e
+      self.pairs.append((elow[i], e))
+      if self.best is None or e < self.best[0]:
+        self.best = (e, np.array(xs[i], dtype=float))
+    return dict(elow=np.array(elow), ehigh=ehigh, promoted=idx)
+
+  async def run(self, x0, niter, npop, scale=0.1, seed=None, constraint=None):
+    """ population search: perturb the best exponents log-normally
+
+    Args:
+      x0 (np.array): initial exponents
+      niter (int): number of generations
+      npop (int): candidates per generation
+      scale (float, optional): std. of log perturbation, default 0.1
+      seed (int, optional): random seed
+      constraint (ExponentBounds, optional): call make_valid on candidates
+    Return:
+      (float, np.array): best production energy and exponents
+    """
+    rng = np.random.default_rng(seed)
+    xbest = np.array(x0, dtype=float)
+    if self.best is None:
+      tstart = time.perf_counter()
+      self.best = (await self.high.get_mp2_energies([xbest]))[0], xbest
+      self.tseed += time.perf_counter() - tstart
+      self.nseed += 1
+    for it in range(niter):
+      xs = []
+      for ipop in range(npop):
+        x = xbest*np.exp(scale*rng.standard_normal(len(xbest)))
+        if constraint is not None:
+          constraint.make_valid(x)
+        xs.append(x)
+      await self.screen(xs)
+      xbest = self.best[1]
+    return self.best
+
+  def cost_saved(self):
+    """ estimated wall time saved compared to running every candidate at
+    production fidelity, using the measured mean cost per promoted
+    evaluation; starting points of run() are not screened, so not counted
+    """
+    if self.nhigh < 1:
+      return 0.
+    tper = self.thigh/self.nhigh
+    return (self.nlow-self.nhigh)*tper - self.tlow
+
+  def report(self):
+    elow, ehigh = zip(*self.pairs) if self.pairs else ([], [])
+    pearson, spearman = correlation(elow, ehigh)
+    line = 'screened %d promoted %d seed %d ' % (self.nlow, self.nhigh,
+      self.nseed)
+    line += 'low %.1fs high %.1fs saved %.1fs ' % (
+      self.tlow, self.thigh, self.cost_saved())
+    line += 'pearson %.3f spearman %.3f' % (pearson, spearman)
+    return line
@@ -0,0 +1,94 @@
+import numpy as np
+
+# QE parameters that change the MP2 energy of a given basis
+KEY_PARAMS = ['prefix', 'out_prefix', 'outdir', 'nks', 'eigcut', 'nextracut',
+  'kpts', 'mesh']
+
+def round_x(x, decimals=10):
+  return np.round(np.asarray(x, dtype=float), decimals) + 0.0  # no -0.0
+
+def hash_key(x, basis_strs, params):
+  """ hash a parameter vector together with what it is evaluated in
+
+  Args:
+    x (np.array): rounded basis set parameters
+    basis_strs (list): basis definition text, one str per element
+    params (dict): QE parameters, only KEY_PARAMS are used
+  Return:
+    str: hex digest
+  """
+  import hashlib
+  h = hashlib.sha256()
+  h.update(np.ascontiguousarray(x, dtype=float).tobytes())
+  for text in basis_strs:
+    h.update(text.encode())
+  for key in KEY_PARAMS:
+    val = params.get(key, None)
+    if val is not None and not isinstance(val, str):
+      val = np.asarray(val).tolist()
+    h.update(('%s=%s;' % (key, val)).encode())
+  return h.hexdigest()
+
+class MP2Cache:
+  """ on-disk MP2 energies and eigenvalues keyed by hash_key
+
+  Entries survive restarts. Once max_entries is exceeded, the least
+  recently used entries are evicted.
+  """
+
+  def __init__(self, fname, max_entries=None):
+    import sqlite3
+    self.fname = fname
+    self.max_entries = max_entries
+    self.db = sqlite3.connect(fname)
+    self.db.execute('''create table if not exists mp2 (
+      key text primary key, emp2 real, evals blob, x blob, atime integer)''')
+    self.db.commit()
+    self.hits = 0
+    self.misses = 0
+
+  def __len__(self):
+    return self.db.execute('select count(*) from mp2').fetchone()[0]
+
+  def next_atime(self):
+    atime = self.db.execute('select max(atime) from mp2').fetchone()[0]
+    if atime is None:
+      return 0
+    return atime+1
+
+  def get(self, key):
+    row = self.db.execute(
+      'select emp2, evals from mp2 where key=?', (key,)).fetchone()
+    if row is None:
+      self.misses += 1
+      return None
+    self.hits += 1
+    self.db.execute('update mp2 set atime=? where key=?',
+      (self.next_atime(), key))
+    self.db.commit()
+    emp2, blob = row
+    evals = None
+    if blob is not None:
+      evals = np.frombuffer(blob, dtype=float).copy()
+    return emp2, evals
+
+  def put(self, key, emp2, evals=None, x=None):
+    if evals is not None:
+      evals = np.asarray(evals, dtype=float).tobytes()
+    if x is not None:
+      x = np.asarray(x, dtype=float).tobytes()
+    self.db.execute('insert or replace into mp2 values (?, ?, ?, ?, ?)',
+      (key, float(emp2), evals, x, self.next_atime()))
+    self.evict()
+    self.db.commit()
+
+  def evict(self):
+    if self.max_entries is None:
+      return
+    nextra = len(self) - self.max_entries
+    if nextra > 0:
+      self.db.execute('''delete from mp2 where key in (
+        select key from mp2 order by atime limit ?)''', (nextra,))
+
+  def close(self):
+    self.db.close()
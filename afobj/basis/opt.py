@@ -270,17 +270,129 @@ class ExponentBounds(object):
           x[i1] = expo0
           x[i0] = expo1
 
+# ========================= level 1: gradient =========================
+def fd_steps(x, rel_step=1e-3, min_step=1e-6):
+  x = np.asarray(x, dtype=float)
+  return rel_step*np.maximum(np.abs(x), min_step/rel_step)
+
+def fd_points(x, steps, central=True, bounds=None):
+  """ displaced parameter vectors for a finite-difference gradient
+
+  Args:
+    x (np.array): parameters
+    steps (np.array): step size for each parameter
+    central (bool, optional): central (2N points) or forward (N points)
+    bounds (list, optional): (lo, hi) for each parameter; a step that
+      would leave the box is taken to the other side, one-sided
+  Return:
+    (list, np.array): xs, signs of shape (N, 2); sign 0 marks an unused
+      side, x itself is not included in xs
+  """
+  x = np.asarray(x, dtype=float)
+  nx = len(x)
+  signs = np.zeros((nx, 2), dtype=int)
+  for i in range(nx):
+    fwd, bwd = True, central
+    if bounds is not None:
+      lo, hi = bounds[i]
+      if lo is not None and x[i]-steps[i] < lo:
+        bwd = False
+      if hi is not None and x[i]+steps[i] > hi:
+        fwd = False
+        bwd = True
+    signs[i] = [int(fwd), -int(bwd)]
+  xs = []
+  for i in range(nx):
+    for sign in signs[i]:
+      if sign != 0:
+        x1 = x.copy()
+        x1[i] += sign*steps[i]
+        xs.append(x1)
+  return xs, signs
+
+def fd_gradient(e0, es, steps, signs):
+  """ assemble gradient from energies at fd_points """
+  grad = np.zeros(len(steps))
+  j = 0
+  for i, (sp, sm) in enumerate(signs):
+    ep = em = e0
+    if sp != 0:
+      ep = es[j]
+      j += 1
+    if sm != 0:
+      em = es[j]
+      j += 1
+    grad[i] = (ep-em)/((abs(sp)+abs(sm))*steps[i])
+  return grad
+
 # ========================= level 2: orbital =========================
 def read_orbs(fh5):
   import h5py
+  from afobj.basis.gto_h5 import read_kpoint_orbitals
   fp = h5py.File(fh5, 'r')
   norb = fp['OrbsG/number_of_orbitals'][()][0]
-  psigl = []
-  for iorb in range(norb):
-    path = 'OrbsG/kp0_b%d' % iorb
-    carr = fp[path][()]
-    psig = carr[:, 0] + 1j*carr[:, 1]
-    psigl.append(psig)
+  cmat = read_kpoint_orbitals(fp['OrbsG'], 0, norb)
   fp.close()
-  cmat = np.array(psigl)
   return cmat
+
+def normalize_overlap(smat):
+  """ scale an overlap matrix to unit diagonal """
+  dnorm = np.sqrt(np.abs(np.diag(smat)))
+  dnorm[dnorm == 0] = 1.
+  return smat/np.outer(dnorm, dnorm)
+
+def orbital_overlap(cmat):
+  """ overlap of orbitals in G-space, normalized to unit diagonal """
+  return normalize_overlap(cmat.conj()@cmat.T)
+
+def blocked_overlap(grp, ik, norb, nblk=64):
+  """ unnormalized overlap of the orbitals at one kpoint
+
+  Accumulated over pairs of row blocks, so at most 2*nblk orbitals are
+  held in memory instead of the whole (norb, ngrid) matrix.
+
+  Args:
+    grp (h5py.Group): OrbsG group
+    ik (int): kpoint index
+    norb (int): number of orbitals at ik
+    nblk (int, optional): orbitals read at a time, default 64
+  Return:
+    np.array: (norb, norb) overlap
+  """
+  from afobj.basis.gto_h5 import read_orbital_rows
+  smat = np.zeros((norb, norb), dtype=np.complex128)
+  for i0 in range(0, norb, nblk):
+    i1 = min(i0+nblk, norb)
+    ci = read_orbital_rows(grp, ik, i0, i1).conj()
+    smat[i0:i1, i0:i1] = ci@ci.conj().T
+    for j0 in range(i1, norb, nblk):
+      j1 = min(j0+nblk, norb)
+      cj = read_orbital_rows(grp, ik, j0, j1)
+      smat[i0:i1, j0:j1] = ci@cj.T
+      smat[j0:j1, i0:i1] = smat[i0:i1, j0:j1].conj().T
+  return smat
+
+def check_lindep(fh5, tol=1e-8, nblk=64):
+  """ conditioning of the orbital overlap at every kpoint
+
+  Args:
+    fh5 (str): orbital file, e.g. written by gen_qe_gto
+    tol (float, optional): eigenvalues below tol*max do not count to rank
+    nblk (int, optional): orbitals read at a time, see blocked_overlap
+  Return:
+    (np.array, np.array): condition number and rank at each kpoint
+  """
+  import h5py
+  fp = h5py.File(fh5, 'r')
+  norbs = fp['OrbsG/number_of_orbitals'][()]
+  conds = []
+  ranks = []
+  for ik in range(len(norbs)):
+    smat = blocked_overlap(fp['OrbsG'], ik, norbs[ik], nblk=nblk)
+    evals = np.linalg.eigvalsh(normalize_overlap(smat))
+    emax = evals[-1]
+    emin = max(evals[0], 0)
+    conds.append(emax/emin if emin > 0 else np.inf)
+    ranks.append((evals > tol*emax).sum())
+  fp.close()
+  return np.array(conds), np.array(ranks)
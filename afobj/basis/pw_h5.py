@@ -2,6 +2,7 @@ import numpy as np
 
 def get_orbs(forb):
   import h5py
+  from afobj.basis.gto_h5 import read_kpoint_orbitals
   fp = h5py.File(forb, 'r')
   alat = fp['OrbsG/alat'][()][0]
   kpts = fp['OrbsG/kpoints'][()]
@@ -13,14 +14,9 @@ def get_orbs(forb):
     npw = len(gvecs)
     kvecs = 2*np.pi/alat*(gvecs+kpt)
     kvl.append(kvecs)
-    cmat = []
-    for ib in range(nb):
-      psigl = fp['OrbsG/kp%d_b%d' % (ik, ib)][()]
-      #psig = psigl[:, 0] + 1j*psigl[:, 1]
-      psig = psigl.view(complex).squeeze()
-      assert np.allclose(psig[npw:], 0)
-      cmat.append(psig[:npw])
-    cmatl.append(np.array(cmat))
+    psig = read_kpoint_orbitals(fp['OrbsG'], ik, nb)
+    assert np.allclose(psig[:, npw:], 0)
+    cmatl.append(psig[:, :npw])
   fp.close()
   return kvl, cmatl
 
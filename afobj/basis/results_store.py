@@ -0,0 +1,163 @@
+import numpy as np
+import asyncio
+
+class ResultsStore:
+  """ append-only optimization history in one HDF5 file
+
+  A single writer task owns the file. append() only buffers a record and
+  wakes the writer, which appends everything buffered so far as one batch
+  to resizable, chunked datasets:
+    iteration (n,), x (n, nx), emp2 (n,), evals (n,) variable length
+
+  The writer lives in the event loop of the latest append(). It writes
+  the remaining records when it is cancelled, e.g. at the end of
+  asyncio.run, so one asyncio.run per evaluation keeps every record.
+  Outside an event loop, append() writes synchronously.
+
+  Example:
+    store = ResultsStore('band.h5')
+    store.append(0, x, emp2, evals)
+    await store.close()
+    hist = read_history('band.h5')
+  """
+
+  def __init__(self, fname, chunk=64, nbatch=256):
+    self.fname = fname
+    self.chunk = chunk
+    self.nbatch = nbatch  # max. records per write
+    self.pending = []  # records not yet written
+    self.task = None
+    self.loop = None
+    self.wake = None
+
+  def alive(self):
+    # writer task running in the current event loop
+    if self.task is None or self.task.done():
+      return False
+    try:
+      return asyncio.get_running_loop() is self.loop
+    except RuntimeError:
+      return False
+
+  def start(self):
+    self.loop = asyncio.get_running_loop()
+    self.wake = asyncio.Event()
+    self.task = self.loop.create_task(self.writer())
+
+  def append(self, iteration, x, emp2, evals=None):
+    if evals is None:
+      evals = []
+    record = (int(iteration), np.array(x, dtype=float), float(emp2),
+      np.array(evals, dtype=float))
+    self.pending.append(record)
+    try:
+      asyncio.get_running_loop()
+    except RuntimeError:  # no event loop, nothing to batch with
+      self.write_pending()
+      return
+    if not self.alive():
+      self.start()
+    self.wake.set()
+
+  async def flush(self):
+    while self.alive() and len(self.pending) > 0:
+      self.wake.set()
+      await asyncio.sleep(0)
+    if self.task is not None and self.task.done() and \
+      not self.task.cancelled() and self.task.exception() is not None:
+      self.task.result()  # writer died, surface its error
+    if len(self.pending) > 0:  # writer belongs to another event loop
+      self.write_pending()
+
+  async def close(self):
+    if self.alive():
+      self.task.cancel()  # the writer writes pending records on the way out
+      try:
+        await self.task
+      except asyncio.CancelledError:
+        pass
+    self.task = None
+    if len(self.pending) > 0:
+      self.write_pending()
+
+  async def writer(self):
+    import h5py
+    fp = h5py.File(self.fname, 'a')
+    try:
+      while True:
+        await self.wake.wait()
+        self.wake.clear()
+        self.write_pending(fp)
+    finally:
+      try:
+        self.write_pending(fp)
+      finally:
+        fp.close()
+
+  def write_pending(self, fp=None):
+    import h5py
+    if len(self.pending) < 1:
+      return
+    if fp is None:
+      with h5py.File(self.fname, 'a') as fp:
+        self.write_pending(fp)
+      return
+    while len(self.pending) > 0:
+      batch = self.pending[:self.nbatch]
+      self.write(fp, batch)
+      del self.pending[:len(batch)]
+    fp.flush()
+
+  def write(self, fp, batch):
+    import h5py
+    its, xs, emp2s, evals = zip(*batch)
+    nx = len(xs[0])
+    if 'iteration' not in fp:
+      chunk = self.chunk
+      fp.create_dataset('iteration', (0,), dtype=int, maxshape=(None,),
+        chunks=(chunk,))
+      fp.create_dataset('x', (0, nx), dtype=float, maxshape=(None, nx),
+        chunks=(chunk, nx))
+      fp.create_dataset('emp2', (0,), dtype=float, maxshape=(None,),
+        chunks=(chunk,))
+      fp.create_dataset('evals', (0,), dtype=h5py.vlen_dtype(float),
+        maxshape=(None,), chunks=(chunk,))
+    n0 = len(fp['iteration'])
+    n1 = n0 + len(batch)
+    for name in ['iteration', 'x', 'emp2', 'evals']:
+      fp[name].resize(n1, axis=0)
+    fp['iteration'][n0:n1] = its
+    fp['x'][n0:n1] = xs
+    fp['emp2'][n0:n1] = emp2s
+    dset = fp['evals']
+    for i, ev in enumerate(evals):  # h5py stacks equal-length rows
+      dset[n0+i] = ev
+
+def read_history(fname):
+  """ read the full history written by ResultsStore, sorted by iteration
+
+  Return:
+    dict: iteration, x, emp2 arrays and evals list
+  """
+  import h5py
+  with h5py.File(fname, 'r') as fp:
+    if 'iteration' not in fp:
+      return dict(iteration=np.zeros(0, dtype=int), x=np.zeros((0, 0)),
+        emp2=np.zeros(0), evals=[])
+    data = {name: fp[name][()] for name in
+      ['iteration', 'x', 'emp2', 'evals']}
+  idx = np.argsort(data['iteration'], kind='stable')
+  hist = {name: data[name][idx] for name in ['iteration', 'x', 'emp2']}
+  hist['evals'] = [data['evals'][i] for i in idx]
+  return hist
+
+def next_iteration(fname):
+  """ first iteration number not yet in the history, 0 without one """
+  import os
+  import h5py
+  if not os.path.isfile(fname):
+    return 0
+  with h5py.File(fname, 'r') as fp:
+    if 'iteration' not in fp or len(fp['iteration']) < 1:
+      return 0
+    return int(fp['iteration'][()].max())+1
@@ -0,0 +1,76 @@
+import os
+import shlex
+import shutil
+import asyncio
+
+class CoreScheduler:
+  """ hand out disjoint sets of cores to concurrent subprocesses
+
+  Each job holds one slot of ncore cores while it runs, so any number of
+  concurrent callers share the node without oversubscription; callers
+  beyond the number of slots wait for a free slot. expand() replaces
+  NPROC in a command with nrank, e.g.
+    ASE_AQEMP2_COMMAND='mpirun --bind-to none -np NPROC pp.x < PREFIX.pwi > PREFIX.pwo'
+  and, given a slot, runs it under taskset for CPU affinity to the slot
+  (skipped if taskset is not installed); popen_kwargs sets
+  OMP_NUM_THREADS = ncore/nrank. Launchers that bind ranks themselves
+  override the affinity set here.
+
+  Free slots are kept per event loop, so one asyncio.run per batch works;
+  jobs of different event loops must not run at the same time.
+
+  Example:
+    sched = CoreScheduler(8, nrank=4)
+    qegto = QEGTO(atoms, bset, params, scheduler=sched)
+  """
+
+  def __init__(self, ncore, cores=None, nrank=1):
+    """
+    Args:
+      ncore (int): cores per job
+      cores (list, optional): usable core ids, default this process' affinity
+      nrank (int, optional): MPI ranks per job, default 1
+    """
+    if cores is None:
+      cores = sorted(os.sched_getaffinity(0))
+    if ncore > len(cores):
+      msg = 'need %d cores per job, have %d' % (ncore, len(cores))
+      raise RuntimeError(msg)
+    if ncore % nrank != 0:
+      msg = '%d ranks do not divide %d cores' % (nrank, ncore)
+      raise RuntimeError(msg)
+    self.ncore = ncore
+    self.nrank = nrank
+    self.slots = [tuple(cores[i:i+ncore])
+      for i in range(0, len(cores)-ncore+1, ncore)]
+    self.free = None
+    self.loop = None  # event loop owning free
+    self.taskset = shutil.which('taskset')
+
+  async def acquire(self):
+    loop = asyncio.get_running_loop()
+    if self.loop is not loop:  # jobs of an earlier loop have ended with it
+      self.free = asyncio.Queue()
+      for slot in self.slots:
+        self.free.put_nowait(slot)
+      self.loop = loop
+    return await self.free.get()
+
+  def release(self, slot):
+    self.free.put_nowait(slot)
+
+  def expand(self, command, slot=None):
+    command = command.replace('NPROC', str(self.nrank))
+    if slot is None or self.taskset is None:
+      return command
+    cpus = ','.join(str(core) for core in slot)
+    # affinity is inherited by the shell and everything it starts
+    return '%s -c %s sh -c %s' % (self.taskset, cpus, shlex.quote(command))
+
+  def env(self, slot):
+    env = os.environ.copy()
+    env['OMP_NUM_THREADS'] = str(len(slot)//self.nrank)
+    return env
+
+  def popen_kwargs(self, slot):
+    return dict(env=self.env(slot))
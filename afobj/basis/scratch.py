@@ -0,0 +1,94 @@
+import os
+import asyncio
+
+def dir_size(path):
+  nbyte = 0
+  for root, dirs, files in os.walk(path):
+    for name in files:
+      try:
+        nbyte += os.path.getsize(os.path.join(root, name))
+      except OSError:  # removed meanwhile
+        pass
+  return nbyte
+
+class ScratchManager:
+  """ run directories on fast scratch, e.g. tmpfs, with a size quota
+
+  acquire() waits while the directories in use exceed the quota; jobs
+  admitted together may overshoot it, so this is a soft limit.
+  release() copies the small files worth keeping to persistent storage
+  and deletes the rest in a worker thread. Waiting is per event loop, so
+  batches in successive asyncio.run calls work, but not concurrent ones.
+
+  Run directories then no longer sit under QEGTO's tmpdir, so commands
+  run in them must not reach SCF files through '../'; WPO_COMMAND has a
+  WORKDIR token for the original location, see QEGTO.wpo_command.
+
+  Example:
+    scratch = ScratchManager('/dev/shm', quota=8*1024**3)
+    qegto = QEGTO(atoms, bset, params, scratch=scratch)
+    # WPO_COMMAND='cd PATH; write_pyscf_orbitals.py FORB WORKDIR/scf.inp ...'
+  """
+
+  def __init__(self, root='/dev/shm', quota=None,
+    keep=('*.pwi', '*.pwo', 'x0.dat')):
+    """
+    Args:
+      root (str, optional): fast scratch location, default /dev/shm
+      quota (int, optional): max. bytes in use before acquire() waits
+      keep (tuple, optional): glob patterns copied back by release()
+    """
+    import atexit
+    import tempfile
+    self.root = tempfile.mkdtemp(prefix='qegto_', dir=root)
+    atexit.register(self.cleanup)
+    self.quota = quota
+    self.keep = keep
+    self.paths = set()
+    self.cond = None
+    self.loop = None  # event loop owning cond
+    self.peak = 0  # max. bytes in use seen by usage()
+
+  def usage(self):
+    nbyte = sum(dir_size(path) for path in self.paths)
+    self.peak = max(self.peak, nbyte)
+    return nbyte
+
+  async def acquire(self, label):
+    loop = asyncio.get_running_loop()
+    if self.loop is not loop:  # e.g. one asyncio.run per batch
+      self.cond = asyncio.Condition()
+      self.loop = loop
+    async with self.cond:
+      if self.quota is not None:  # always admit one job
+        await self.cond.wait_for(
+          lambda: len(self.paths) < 1 or self.usage() < self.quota)
+      path = os.path.join(self.root, label)
+      os.makedirs(path, exist_ok=True)
+      self.paths.add(path)
+    return path
+
+  def copy_keep(self, path, keep_path):
+    import glob
+    import shutil
+    os.makedirs(keep_path, exist_ok=True)
+    for pattern in self.keep:
+      for fname in glob.glob(os.path.join(path, pattern)):
+        shutil.copy2(fname, keep_path)
+
+  async def release(self, path, keep_path=None):
+    """ copy kept files to keep_path, if given, then delete path """
+    import shutil
+    loop = asyncio.get_running_loop()
+    try:
+      if keep_path is not None:
+        await loop.run_in_executor(None, self.copy_keep, path, keep_path)
+      await loop.run_in_executor(None, shutil.rmtree, path, True)
+    finally:
+      async with self.cond:
+        self.paths.discard(path)
+        self.cond.notify_all()
+
+  def cleanup(self):
+    import shutil
+    shutil.rmtree(self.root, ignore_errors=True)
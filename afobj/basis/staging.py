@@ -0,0 +1,57 @@
+import os
+import shutil
+
+def link_or_copy(src, dst):
+  try:
+    os.link(src, dst)
+  except OSError:  # e.g. across file systems
+    shutil.copy2(src, dst)
+
+class StagedOutdir:
+  """ one node-local copy of a read-only QE outdir
+
+  Concurrent MP2 runs then read SCF wavefunctions from local scratch or
+  tmpfs rather than all opening the same files on a shared file system.
+  Hard links are only safe if nothing writes into the staged outdir.
+
+  Example:
+    staged = StagedOutdir('qeout/', os.environ.get('TMPDIR', '/tmp'))
+    outdir = staged.stage()  # copies on first call only
+    staged.cleanup()
+  """
+
+  def __init__(self, outdir, scratch, link=False):
+    """
+    Args:
+      outdir (str): QE outdir to stage
+      scratch (str): node-local directory to stage into
+      link (bool, optional): hard link instead of copy when possible
+    """
+    self.outdir = os.path.abspath(outdir)
+    self.scratch = scratch
+    self.link = link
+    self.path = None
+
+  def stage(self):
+    if self.path is not None:
+      return self.path
+    import atexit
+    import tempfile
+    tmp = tempfile.mkdtemp(prefix='qeout_', dir=self.scratch)
+    path = os.path.join(tmp, os.path.basename(self.outdir.rstrip('/')))
+    copy = link_or_copy if self.link else shutil.copy2
+    try:
+      shutil.copytree(self.outdir, path, copy_function=copy)
+    except BaseException:
+      shutil.rmtree(tmp, ignore_errors=True)
+      raise
+    self.tmp = tmp
+    self.path = path + '/'  # QEGTO outdir convention
+    atexit.register(self.cleanup)
+    return self.path
+
+  def cleanup(self):
+    if self.path is None:
+      return
+    shutil.rmtree(self.tmp, ignore_errors=True)
+    self.path = None
@@ -0,0 +1,184 @@
+import numpy as np
+
+# ========================= level 0: model =========================
+def rbf_kernel(x1, x2, ls):
+  d = (x1[:, None, :] - x2[None, :, :])/ls
+  return np.exp(-0.5*(d**2).sum(axis=-1))
+
+class GaussianProcess:
+  """ GP regression with a constant mean and an isotropic RBF kernel
+
+  Inputs are expected in the unit cube, see SurrogateOptimizer.scale.
+  The length scale and noise are picked from small grids by maximizing
+  the log marginal likelihood.
+  """
+
+  def __init__(self, ls_grid=None, noise_grid=None):
+    if ls_grid is None:
+      ls_grid = np.geomspace(0.05, 2.0, 12)
+    if noise_grid is None:
+      noise_grid = [1e-6, 1e-4, 1e-2]
+    self.ls_grid = ls_grid
+    self.noise_grid = noise_grid
+    self.ls = None
+    self.noise = None
+
+  def factorize(self, X, y, ls, noise):
+    kmat = rbf_kernel(X, X, ls) + noise*np.eye(len(X))
+    chol = np.linalg.cholesky(kmat)
+    alpha = np.linalg.solve(chol.T, np.linalg.solve(chol, y))
+    return chol, alpha
+
+  def fit(self, X, y, optimize=True):
+    X = np.asarray(X, dtype=float)
+    y = np.asarray(y, dtype=float)
+    self.ymean = y.mean()
+    self.ystd = y.std() if y.std() > 0 else 1.
+    yn = (y-self.ymean)/self.ystd
+    if optimize or self.ls is None:
+      best = None
+      for ls in self.ls_grid:
+        for noise in self.noise_grid:
+          try:
+            chol, alpha = self.factorize(X, yn, ls, noise)
+          except np.linalg.LinAlgError:
+            continue
+          lml = -0.5*yn@alpha - np.log(np.diag(chol)).sum()
+          if best is None or lml > best[0]:
+            best = (lml, ls, noise)
+      if best is None:
+        msg = 'failed to fit GP to %d points' % len(X)
+        raise RuntimeError(msg)
+      self.ls, self.noise = best[1:]
+    self.X = X
+    self.chol, self.alpha = self.factorize(X, yn, self.ls, self.noise)
+
+  def predict(self, Xs):
+    ks = rbf_kernel(np.asarray(Xs, dtype=float), self.X, self.ls)
+    mu = ks@self.alpha
+    v = np.linalg.solve(self.chol, ks.T)
+    var = np.clip(1.-(v**2).sum(axis=0), 1e-12, None)
+    return self.ymean+self.ystd*mu, self.ystd*np.sqrt(var)
+
+def expected_improvement(mu, sig, ybest, xi=0.):
+  from scipy.stats import norm
+  z = (ybest-mu-xi)/sig
+  return (ybest-mu-xi)*norm.cdf(z) + sig*norm.pdf(z)
+
+# ========================= level 1: optimizer =========================
+class SurrogateOptimizer:
+  """ propose batches of exponent vectors from a GP fit of past energies
+
+  Example:
+    bset, x0, xbounds = default_small_contracted_basis(lmax, elems)
+    sopt = SurrogateOptimizer(xbounds)
+    sopt.tell_df(read_qe_out('opt.out'))  # warm start
+    emin, xmin = await sopt.run(qegto, niter=10, nbatch=4)
+  """
+
+  def __init__(self, bounds, constraint=None, ncand=2048, seed=None):
+    """
+    Args:
+      bounds (list): (lo, hi) for every parameter
+      constraint (ExponentBounds, optional): only propose x with
+        constraint(x_new=x), after trying constraint.make_valid(x)
+      ncand (int, optional): random candidates per proposal
+      seed (int, optional): random seed
+    """
+    bounds = np.array(bounds, dtype=float)
+    self.lo = bounds[:, 0]
+    self.hi = bounds[:, 1]
+    self.constraint = constraint
+    self.ncand = ncand
+    self.rng = np.random.default_rng(seed)
+    self.gp = GaussianProcess()
+    self.X = np.zeros((0, len(bounds)))
+    self.y = np.zeros(0)
+
+  def scale(self, x):
+    return (np.asarray(x, dtype=float)-self.lo)/(self.hi-self.lo)
+
+  def unscale(self, u):
+    return self.lo + u*(self.hi-self.lo)
+
+  def valid(self, x):
+    if self.constraint is None:
+      return True
+    self.constraint.make_valid(x)
+    return self.constraint(x_new=x)
+
+  def tell(self, xs, ys):
+    xs = np.asarray(xs, dtype=float).reshape(-1, len(self.lo))
+    self.X = np.concatenate([self.X, xs], axis=0)
+    self.y = np.concatenate([self.y, np.ravel(ys)])
+
+  def tell_df(self, df, ycol='emp2'):
+    """ warm start from read_qe_out or read_opt_log """
+    from afobj.basis.opt import get_descriptors
+    sel = np.isfinite(df[ycol].values)
+    self.tell(get_descriptors(df.loc[sel]), df.loc[sel, ycol].values)
+
+  def best(self):
+    i = np.argmin(self.y)
+    return self.y[i], self.X[i]
+
+  def candidates(self):
+    nx = len(self.lo)
+    nrand = self.ncand//2
+    ulist = [self.rng.random((nrand, nx))]
+    if len(self.y) > 0:  # refine around the current best
+      ub = self.scale(self.best()[1])
+      du = 0.05*self.rng.standard_normal((self.ncand-nrand, nx))
+      ulist.append(np.clip(ub+du, 0, 1))
+    return np.concatenate(ulist, axis=0)
+
+  def ask(self, nbatch=1):
+    """ propose nbatch points using the kriging believer heuristic
+
+    Return:
+      list: exponent vectors
+    """
+    if len(self.y) < 2:  # nothing to fit yet, sample at random
+      xs = []
+      for itry in range(self.ncand*nbatch):  # as many tries as candidates
+        x = self.unscale(self.rng.random(len(self.lo)))
+        if self.valid(x):
+          xs.append(x)
+          if len(xs) >= nbatch:
+            return xs
+      msg = 'no candidate satisfies the constraint'
+      raise RuntimeError(msg)
+    U = self.scale(self.X)
+    y = self.y.copy()
+    self.gp.fit(U, y)
+    xs = []
+    for ib in range(nbatch):
+      cand = self.candidates()
+      mu, sig = self.gp.predict(cand)
+      acq = expected_improvement(mu, sig, y.min())
+      for ic in np.argsort(-acq):
+        x = self.unscale(cand[ic])
+        if self.valid(x):
+          break
+      else:
+        msg = 'no candidate satisfies the constraint'
+        raise RuntimeError(msg)
+      u = self.scale(x)
+      xs.append(x)
+      # believe the model at x to spread the rest of the batch
+      U = np.concatenate([U, u[None]], axis=0)
+      y = np.concatenate([y, self.gp.predict(u[None])[0]])
+      self.gp.fit(U, y, optimize=False)
+    return xs
+
+  async def run(self, qegto, niter, nbatch, max_concurrency=None):
+    """ ask, evaluate concurrently with qegto.get_mp2_energies, tell
+
+    Return:
+      (float, np.array): lowest energy and its exponents
+    """
+    for it in range(niter):
+      xs = self.ask(nbatch)
+      ys = await qegto.get_mp2_energies(xs, max_concurrency=max_concurrency)
+      self.tell(xs, ys)
+    return self.best()
@@ -0,0 +1,153 @@
+import time
+import resource
+from collections import OrderedDict
+from contextlib import contextmanager
+
+def reset_peak_rss():
+  # Linux: writing 5 to clear_refs resets VmHWM of this process
+  try:
+    with open('/proc/self/clear_refs', 'w') as f:
+      f.write('5')
+    return True
+  except OSError:
+    return False
+
+def peak_rss():
+  """ peak resident set size of this process in bytes
+
+  VmHWM since the last reset_peak_rss() where available, otherwise the
+  lifetime maximum from getrusage.
+  """
+  try:
+    with open('/proc/self/status', 'r') as f:
+      for line in f:
+        if line.startswith('VmHWM:'):
+          return int(line.split()[1])*1024
+  except OSError:
+    pass
+  return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+class StageTimer:
+  """ wall time, CPU time and peak RSS of named pipeline stages
+
+  Repeated stages with the same name and tags are accumulated into one
+  record; write() appends the records as JSON lines to log.
+
+  peak_rss is the peak of this (driver) process only. It is reset at the
+  start of every stage and propagated to the enclosing stages, so it is
+  only meaningful for stages that do not run concurrently with others in
+  this process. Subprocess stages, e.g. pp.x or write_pyscf_orbitals.py,
+  report the CPU time of reaped children in cpu_children and, in
+  peak_rss_children, the largest RSS of any child reaped so far, or 0 if
+  the stage reaped none; the OS keeps no per-stage child peak, so this
+  is an upper bound for the children of the stage. A long-lived orbital server is only reaped at
+  QEGTO.close(); time it with its own --timing log instead.
+
+  Example:
+    timer = StageTimer('timing.jsonl', iteration=3)
+    with timer.stage('fft', ik=0):
+      ...
+    timer.write()
+    print(summarize('timing.jsonl'))
+  """
+
+  def __init__(self, log=None, **tags):
+    self.log = log
+    self.tags = tags
+    self.records = OrderedDict()
+    self.stack = []
+
+  @contextmanager
+  def stage(self, name, **tags):
+    frame = {'peak': 0}
+    self.stack.append(frame)
+    reset_peak_rss()
+    wall0 = time.perf_counter()
+    cpu0 = time.process_time()
+    child0 = resource.getrusage(resource.RUSAGE_CHILDREN)
+    try:
+      yield
+    finally:
+      wall = time.perf_counter()-wall0
+      cpu = time.process_time()-cpu0
+      child1 = resource.getrusage(resource.RUSAGE_CHILDREN)
+      cpu_children = (child1.ru_utime+child1.ru_stime) -\
+        (child0.ru_utime+child0.ru_stime)
+      peak = max(peak_rss(), frame['peak'])
+      self.stack.pop()
+      if len(self.stack) > 0:
+        self.stack[-1]['peak'] = max(self.stack[-1]['peak'], peak)
+      peak_children = 0  # only for stages that reaped a child
+      if cpu_children > 0 or child1.ru_maxrss > child0.ru_maxrss:
+        peak_children = child1.ru_maxrss*1024
+      self.add(name, wall, cpu, cpu_children, peak, peak_children, **tags)
+
+  def add(self, name, wall, cpu=0., cpu_children=0., peak=0,
+    peak_children=0, **tags):
+    key = (name,) + tuple(sorted(tags.items()))
+    rec = self.records.get(key, None)
+    if rec is None:
+      rec = dict(stage=name, count=0, wall=0., cpu=0., cpu_children=0.,
+        peak_rss=0, peak_rss_children=0)
+      rec.update(self.tags)
+      rec.update(tags)
+      self.records[key] = rec
+    rec['count'] += 1
+    rec['wall'] += wall
+    rec['cpu'] += cpu
+    rec['cpu_children'] += cpu_children
+    rec['peak_rss'] = max(rec['peak_rss'], int(peak))
+    rec['peak_rss_children'] = max(rec['peak_rss_children'],
+      int(peak_children))
+
+  def write(self):
+    import json
+    if self.log is None:
+      return
+    with open(self.log, 'a') as f:
+      for rec in self.records.values():
+        f.write(json.dumps(rec, default=float)+'\n')
+    self.records = OrderedDict()
+
+def timed(timer, name, **tags):
+  """ timer.stage(name, **tags), or a no-op context if timer is None """
+  if timer is None:
+    from contextlib import nullcontext
+    return nullcontext()
+  return timer.stage(name, **tags)
+
+def read_timing(log):
+  import json
+  with open(log, 'r') as f:
+    return [json.loads(line) for line in f if line.strip()]
+
+def summarize(log, by=('stage',)):
+  """ aggregate timing records over iterations
+
+  Args:
+    log (str): JSON lines written by StageTimer.write
+    by (tuple, optional): record keys to group by, default stage
+  Return:
+    str: table of count, total and mean wall time per stage call, CPU
+      time, and max. peak RSS of the driver and of its children
+  """
+  groups = OrderedDict()
+  for rec in read_timing(log):
+    key = tuple(rec.get(name, None) for name in by)
+    tot = groups.setdefault(key, dict(count=0, wall=0., cpu=0.,
+      cpu_children=0., peak_rss=0, peak_rss_children=0))
+    for name in ['count', 'wall', 'cpu', 'cpu_children']:
+      tot[name] += rec[name]
+    for name in ['peak_rss', 'peak_rss_children']:
+      tot[name] = max(tot[name], rec.get(name, 0))
+  header = '%-24s %8s %10s %10s %10s %10s %10s %10s' % (
+    '/'.join(by), 'count', 'wall(s)', 'wall/call', 'cpu(s)', 'child(s)',
+    'peak(MB)', 'child(MB)')
+  lines = [header]
+  for key, tot in groups.items():
+    name = '/'.join(str(k) for k in key)
+    lines.append('%-24s %8d %10.3f %10.3f %10.3f %10.3f %10.1f %10.1f' % (
+      name, tot['count'], tot['wall'], tot['wall']/max(tot['count'], 1),
+      tot['cpu'], tot['cpu_children'], tot['peak_rss']/1024**2,
+      tot['peak_rss_children']/1024**2))
+  return '\n'.join(lines)
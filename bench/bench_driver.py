@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+import os
+import sys
+import time
+import asyncio
+import numpy as np
+
+def setup_env(sleep, cpu, nao, mb, server):
+  # point QEGTO/AQEMP2 at fake_ppx.py
+  fake = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fake_ppx.py')
+  py = sys.executable
+  os.environ['ASE_AQEMP2_COMMAND'] = '%s %s mp2 PREFIX.pwi PREFIX.pwo '\
+    '--sleep %g --burn %g' % (py, fake, sleep, cpu)
+  if server:
+    os.environ['WPO_SERVER_COMMAND'] = '%s %s serve FORB --nao %d --mb %g' % (
+      py, fake, nao, mb)
+  else:
+    os.environ['WPO_COMMAND'] = 'cd PATH; %s %s orbitals FORB --nao %d '\
+      '--mb %g' % (py, fake, nao, mb)
+
+def make_qegto(tmpdir, poll, **kwargs):
+  from ase import Atoms
+  from afobj.basis.aqemp2 import QEGTO
+  atoms = Atoms('H', cell=[3.]*3, pbc=True)
+  params = dict(nks=1, kpts=np.zeros((1, 3)))
+  qegto = QEGTO(atoms, None, params, tmpdir=tmpdir,
+    fband_h5=os.path.join(tmpdir, 'band.h5'), **kwargs)
+  qegto.calc.poll = poll
+  return qegto
+
+async def sequential(qegto, xs):
+  walls = []
+  for x in xs:
+    tstart = time.perf_counter()
+    await qegto.get_mp2_energy(x, keep_qe_io=False)
+    walls.append(time.perf_counter()-tstart)
+  return walls
+
+async def batch(qegto, xs, nconc):
+  tstart = time.perf_counter()
+  await qegto.get_mp2_energies(xs, max_concurrency=nconc, keep_qe_io=False)
+  return time.perf_counter()-tstart
+
+async def main(args):
+  import tempfile
+  from afobj.basis.scratch import ScratchManager
+  setup_env(args.sleep, args.burn, args.nao, args.mb, args.server)
+  tmp = tempfile.mkdtemp(prefix='bench_driver_', dir=args.scratch)
+  tmpdir = tmp + '/'
+  kwargs = dict(verbose=args.verbose, wpo_server=args.server)
+  if args.timing is not None:
+    kwargs['timing_log'] = args.timing
+  if args.shm is not None:
+    kwargs['scratch'] = ScratchManager(args.shm)
+  rng = np.random.default_rng(args.seed)
+  def sample(n):
+    return [np.exp(rng.standard_normal(args.nx)) for i in range(n)]
+  results = dict(sleep=args.sleep, burn=args.burn, nao=args.nao, mb=args.mb,
+    server=args.server, poll=args.poll, shm=args.shm)
+
+  # per-iteration overhead of the driver loop
+  qegto = make_qegto(tmpdir, args.poll, **kwargs)
+  walls = await sequential(qegto, sample(args.niter))
+  await qegto.close()
+  job = args.sleep + args.burn
+  results['sequential'] = dict(walls=walls, mean=np.mean(walls[1:]),
+    overhead=np.mean(walls[1:])-job)
+  print('sequential: %.3fs per iteration, %.3fs over the %.3fs job' % (
+    results['sequential']['mean'], results['sequential']['overhead'], job))
+
+  # concurrency scaling
+  results['concurrency'] = []
+  print('%6s %6s %10s %10s %10s' % ('nconc', 'njob', 'wall(s)', 'jobs/s',
+    'efficiency'))
+  for nconc in args.concurrency:
+    qegto = make_qegto(tmpdir, args.poll, **kwargs)
+    njob = nconc*args.nbatch
+    wall = await batch(qegto, sample(njob), nconc)
+    await qegto.close()
+    ideal = args.nbatch*job  # perfectly overlapped jobs, no overhead
+    eff = ideal/wall if wall > 0 else np.nan
+    results['concurrency'].append(dict(nconc=nconc, njob=njob, wall=wall,
+      throughput=njob/wall, efficiency=eff))
+    print('%6d %6d %10.3f %10.2f %10.2f' % (nconc, njob, wall, njob/wall,
+      eff), flush=True)
+  import shutil
+  shutil.rmtree(tmp, ignore_errors=True)
+  return results
+
+if __name__ == '__main__':
+  msg = 'time the QEGTO driver loop against fake_ppx.py, e.g.\n'
+  msg += 'python3 bench_driver.py --sleep 0.5 --concurrency 1 2 4 8'
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description=msg)
+  parser.add_argument('--sleep', type=float, default=0.5,
+    help='idle seconds of each fake pp.x run')
+  parser.add_argument('--burn', type=float, default=0.,
+    help='CPU seconds of each fake pp.x run')
+  parser.add_argument('--nao', type=int, default=32)
+  parser.add_argument('--mb', type=float, default=1.,
+    help='size of each fake orbital file in MB')
+  parser.add_argument('--nx', type=int, default=12,
+    help='number of basis set parameters')
+  parser.add_argument('--niter', type=int, default=5,
+    help='sequential iterations')
+  parser.add_argument('--concurrency', type=int, nargs='+',
+    default=[1, 2, 4, 8])
+  parser.add_argument('--nbatch', type=int, default=2,
+    help='jobs per concurrency slot in the scaling runs')
+  parser.add_argument('--poll', type=float, default=0.1,
+    help='seconds between .pwo scans, see AQEMP2.poll')
+  parser.add_argument('--server', action='store_true',
+    help='use the persistent orbital server')
+  parser.add_argument('--shm', type=str, default=None,
+    help='put run directories on this fast scratch, e.g. /dev/shm')
+  parser.add_argument('--scratch', type=str, default='.',
+    help='directory for run directories')
+  parser.add_argument('--timing', type=str, default=None,
+    help='append stage timings to this JSON lines file')
+  parser.add_argument('--verbose', action='store_true',
+    help='print energies and write band.h5')
+  parser.add_argument('--seed', type=int, default=0)
+  parser.add_argument('--output', '-o', type=str, default=None,
+    help='write results as JSON')
+  args = parser.parse_args()
+
+  results = asyncio.run(main(args))
+  if args.timing is not None:
+    from afobj.basis.timing import summarize
+    print(summarize(args.timing))
+  if args.output is not None:
+    import json
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=1, default=float)
+# end __main__
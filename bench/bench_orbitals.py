@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+import os
+import sys
+import numpy as np
+
+class EvenTemperedSet:
+  """ synthetic stand-in for default_basis_set(lmax, elems)
+
+  Shell n carries angular momenta l=0..n+2 with exponent x[index_nl(n, l)],
+  giving get_nexpo_per_elem(lmax) parameters per element.
+  """
+  angs = 'SPDFGHI'
+
+  def __init__(self, lmax):
+    from afobj.basis.opt import get_nexpo_per_elem
+    self.lmax = lmax
+    self.number_of_params = get_nexpo_per_elem(lmax)
+
+  def x0(self, alpha=0.3, beta=2.5):
+    from afobj.basis.opt import index_nl
+    x = np.zeros(self.number_of_params)
+    for n in range(self.lmax-1):
+      for l in range(n+3):
+        x[index_nl(n, l)] = alpha*beta**n
+    return x
+
+  def basis_str(self, elem, x):
+    from afobj.basis.opt import index_nl
+    text = ''
+    for n in range(self.lmax-1):
+      for l in range(n+3):
+        text += '%s %s\n  %.8f 1.0\n' % (elem, self.angs[l], x[index_nl(n, l)])
+    return text
+
+def make_case(lmax, nk):
+  from ase.build import bulk
+  atoms = bulk('C', 'diamond', a=3.567)
+  bset = EvenTemperedSet(lmax)
+  raxes = 2*np.pi*np.linalg.inv(atoms.cell.array).T
+  kpts = np.array([ik*raxes[0]/nk for ik in range(nk)])  # nk x 1 x 1 grid
+  return atoms, bset, kpts
+
+def run_case(lmax, mesh, nk, kc, fname, **kwargs):
+  from afobj.basis.gto_h5 import gen_qe_gto, clear_cell_cache
+  from afobj.basis.timing import StageTimer
+  atoms, bset, kpts = make_case(lmax, nk)
+  clear_cell_cache()  # time cell construction too
+  timer = StageTimer()
+  with timer.stage('gen_qe_gto'):
+    norb = gen_qe_gto(atoms, bset, bset.x0(), kpts, fname=fname,
+      mesh=[mesh]*3, kc=kc, **kwargs)
+  rec = list(timer.records.values())[0]
+  size = os.path.getsize(fname)
+  os.remove(fname)
+  return dict(norb=norb, wall=rec['wall'], cpu=rec['cpu'],
+    peak_rss=rec['peak_rss'], file_size=size)
+
+def case_key(entry):
+  return (entry['lmax'], entry['mesh'], entry['nk'], entry['kc'])
+
+def compare(results, baseline, tol):
+  """ print time ratios to baseline, return number of regressions """
+  base = {case_key(entry): entry for entry in baseline['results']}
+  if baseline.get('options', None) != results['options']:
+    sys.stderr.write('warning: baseline options %s differ from %s\n' % (
+      baseline.get('options', None), results['options']))
+  nbad = 0
+  print('%5s %5s %4s %6s %10s %10s %8s' % ('lmax', 'mesh', 'nk', 'kc',
+    'wall(s)', 'base(s)', 'ratio'))
+  for entry in results['results']:
+    ref = base.get(case_key(entry), None)
+    if ref is None:
+      continue
+    ratio = entry['wall']/ref['wall']
+    flag = ''
+    if ratio > tol:
+      flag = ' REGRESSION'
+      nbad += 1
+    print('%5d %5d %4d %6s %10.3f %10.3f %8.2f%s' % (entry['lmax'],
+      entry['mesh'], entry['nk'], entry['kc'], entry['wall'], ref['wall'],
+      ratio, flag))
+  return nbad
+
+if __name__ == '__main__':
+  msg = 'time gen_qe_gto on synthetic diamond cells, e.g.\n'
+  msg += 'python3 bench_orbitals.py --lmax 2 3 --mesh 16 24 --nk 1 4 '
+  msg += '-o new.json --baseline old.json'
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description=msg)
+  parser.add_argument('--lmax', type=int, nargs='+', default=[2, 3])
+  parser.add_argument('--mesh', type=int, nargs='+', default=[16, 24])
+  parser.add_argument('--nk', type=int, nargs='+', default=[1, 4])
+  parser.add_argument('--kc', type=str, nargs='+', default=['none'],
+    help='PW cutoffs, "none" for GTOs only')
+  parser.add_argument('--repeat', type=int, default=3,
+    help='report the fastest of this many runs')
+  parser.add_argument('--nblk', type=int, default=None)
+  parser.add_argument('--layout', type=str, default='orbital',
+    choices=['orbital', 'kpoint'])
+  parser.add_argument('--nworker', '-nw', type=int, default=1)
+  parser.add_argument('--analytic', action='store_true')
+  parser.add_argument('--time_reversal', '-tr', action='store_true')
+  parser.add_argument('--scratch', type=str, default='.',
+    help='directory for the temporary orbital file')
+  parser.add_argument('--output', '-o', type=str, default=None,
+    help='write results as JSON')
+  parser.add_argument('--baseline', type=str, default=None,
+    help='JSON from an earlier run to compare against')
+  parser.add_argument('--tol', type=float, default=1.2,
+    help='wall time ratio to baseline counted as a regression')
+  args = parser.parse_args()
+
+  import json
+  import time
+  import platform
+  import pyscf
+  options = dict(nblk=args.nblk, layout=args.layout, nworker=args.nworker,
+    analytic=args.analytic, time_reversal=args.time_reversal)
+  results = dict(
+    host=platform.node(), python=platform.python_version(),
+    numpy=np.__version__, pyscf=pyscf.__version__,
+    date=time.strftime('%Y-%m-%d %H:%M:%S'), repeat=args.repeat,
+    options=options, results=[])
+  fname = os.path.join(args.scratch, 'bench_orbitals.%d.h5' % os.getpid())
+  kcs = [None if kc.lower() == 'none' else float(kc) for kc in args.kc]
+  for lmax in args.lmax:
+    for mesh in args.mesh:
+      for nk in args.nk:
+        for kc in kcs:
+          runs = [run_case(lmax, mesh, nk, kc, fname, **options)
+            for irep in range(args.repeat)]
+          best = min(runs, key=lambda run: run['wall'])
+          entry = dict(lmax=lmax, mesh=mesh, nk=nk, kc=kc, **best)
+          entry['peak_rss'] = max(run['peak_rss'] for run in runs)
+          entry['walls'] = [run['wall'] for run in runs]
+          results['results'].append(entry)
+          print('lmax %d mesh %d nk %d kc %s: norb %d %.3fs %.1fMB %.1fMB' % (
+            lmax, mesh, nk, kc, entry['norb'], entry['wall'],
+            entry['peak_rss']/1024**2, entry['file_size']/1024**2),
+            flush=True)
+  if args.output is not None:
+    with open(args.output, 'w') as f:
+      json.dump(results, f, indent=1)
+  if args.baseline is not None:
+    with open(args.baseline, 'r') as f:
+      baseline = json.load(f)
+    nbad = compare(results, baseline, args.tol)
+    if nbad > 0:
+      sys.exit(1)
+# end __main__
@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+""" stand-ins for pp.x (mp2_driver) and write_pyscf_orbitals.py
+
+  fake_ppx.py mp2 qemp2.pwi qemp2.pwo --sleep 1.0
+  fake_ppx.py orbitals orbitals.h5 --nao 64 --mb 10
+  fake_ppx.py serve orbitals.h5 --nao 64
+"""
+import os
+import sys
+import time
+import numpy as np
+
+def read_pwi(fpwi):
+  params = {}
+  with open(fpwi, 'r') as f:
+    for line in f:
+      if '=' not in line:
+        continue
+      key, val = line.split('=', 1)
+      params[key.strip()] = val.strip().strip("'")
+  return params
+
+def fake_emp2(path, x0=1.3, scale=0.01):
+  # smooth in the exponents of x0.dat so optimizers see a landscape
+  fx0 = os.path.join(path, 'x0.dat')
+  emp2 = -0.5
+  if os.path.isfile(fx0):
+    try:
+      x = np.atleast_1d(np.loadtxt(fx0))
+      emp2 += scale*np.sum((np.log(np.abs(x)+1e-8)-np.log(x0))**2)
+    except ValueError:  # basis text
+      pass
+  return emp2
+
+def burn(seconds):
+  tstart = time.perf_counter()
+  a = 0.
+  while time.perf_counter()-tstart < seconds:
+    a += np.sum(np.sqrt(np.arange(1000.)))
+  return a
+
+def mp2(fpwi, fpwo, sleep=0., cpu=0., fail=False):
+  params = read_pwi(fpwi)
+  nks = int(params.get('number_of_orbitals', 1))
+  ngto = int(params.get('read_from_h5', 0))
+  time.sleep(sleep)
+  burn(cpu)
+  path = os.path.dirname(os.path.abspath(fpwi))
+  text = '     Program PP (fake)\n\n'
+  text += '     Eigenvalues for k-point 1\n'
+  for ib in range(nks+ngto):
+    text += '%8d %16.8f\n' % (ib+1, -0.5+0.1*ib)
+  if fail:
+    text += '     Error in routine fake_mp2 (1):\n'
+  else:
+    text += '     Starting MP2\n'
+    text += '     EMP2 (Ha): (%.10f, 0.0)\n' % fake_emp2(path)
+  with open(fpwo, 'w') as f:
+    f.write(text)
+  return 1 if fail else 0
+
+def orbitals(forb, nao, mb=0.):
+  with open(forb, 'wb') as f:
+    f.write(b'\0'*int(mb*1024**2))
+  return nao
+
+def serve(forb, nao, mb=0.):
+  for line in sys.stdin:
+    path = line.strip().split('\t')[0]  # ignore a reference directory
+    if len(path) < 1:
+      continue
+    orbitals(os.path.join(path, forb), nao, mb)
+    sys.stdout.write('%d\n' % nao)
+    sys.stdout.flush()
+
+if __name__ == '__main__':
+  from argparse import ArgumentParser
+  parser = ArgumentParser(description=__doc__)
+  sub = parser.add_subparsers(dest='mode', required=True)
+  p = sub.add_parser('mp2', help='write a .pwo like pp.x mp2_driver')
+  p.add_argument('fpwi', type=str)
+  p.add_argument('fpwo', type=str)
+  p.add_argument('--sleep', type=float, default=0.,
+    help='seconds to wait idle')
+  p.add_argument('--burn', type=float, default=0.,
+    help='seconds of CPU to spend')
+  p.add_argument('--fail', action='store_true',
+    help='write a QE error instead of an energy')
+  for mode in ['orbitals', 'serve']:
+    p = sub.add_parser(mode, help='fake write_pyscf_orbitals.py')
+    p.add_argument('forb', type=str)
+    p.add_argument('--nao', type=int, default=32)
+    p.add_argument('--mb', type=float, default=0.,
+      help='size of the orbital file in MB')
+  args = parser.parse_args()
+
+  if args.mode == 'mp2':
+    sys.exit(mp2(args.fpwi, args.fpwo, args.sleep, args.burn, args.fail))
+  elif args.mode == 'orbitals':
+    print(orbitals(args.forb, args.nao, args.mb))
+  else:
+    serve(args.forb, args.nao, args.mb)
+# end __main__
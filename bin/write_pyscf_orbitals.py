@@ -52,16 +52,75 @@ def read_settings(qeinp, qeout):
   params['kpts'] = kpts
   return atoms, outdir, elem, params
 
-def write_orbs(fout, scf_inp, scf_out, lmax, x, kc=None):
+def write_orbs(fout, scf_inp, scf_out, lmax, x, kc=None, nblk=None,
+  layout='orbital', nworker=1, time_reversal=False, ref_x=None,
+  ref_fname=None, timer=None):
   from afqmctools.utils.optimizable_basis_set import default_basis_set
   from afobj.basis.gto_h5 import gen_qe_gto
   # read parameters
   atoms, outdir, elem, params = read_settings(scf_inp, scf_out)
   _, basis_set = default_basis_set(lmax, elem)
   nao = gen_qe_gto(atoms, basis_set, x, params['kpts'],
-    fname=fout, mesh=params['mesh'], kc=kc)
+    fname=fout, mesh=params['mesh'], kc=kc, nblk=nblk, layout=layout,
+    nworker=nworker, time_reversal=time_reversal, ref_x=ref_x,
+    ref_fname=ref_fname, timer=timer)
   return nao
 
+def read_x(fx0):
+  try:
+    x = np.loadtxt(fx0)
+  except ValueError:  # basis text for load_element
+    x = fx0
+  return x
+
+def serve(forb, scf_inp, scf_out, lmax, fx0, fin=None, fout=None,
+  timing_log=None, **kwargs):
+  """ keep settings loaded and write orbitals on request
+
+  Each line read from fin is a directory; x is read from fx0 in it and the
+  orbitals are written to forb in it. A second, tab-separated directory
+  holding forb and fx0 of a reference point makes the request recompute
+  only shells changed from it. The reply on fout is one line with the
+  number of orbitals, or "error: ..." if that request failed.
+  Given timing_log, stage timings of each request are appended to it.
+  """
+  import sys
+  from afqmctools.utils.optimizable_basis_set import default_basis_set
+  from afobj.basis.gto_h5 import gen_qe_gto
+  from afobj.basis.timing import StageTimer
+  if fin is None:
+    fin = sys.stdin
+  if fout is None:
+    fout = sys.stdout
+  atoms, outdir, elem, params = read_settings(scf_inp, scf_out)
+  _, basis_set = default_basis_set(lmax, elem)
+  for line in fin:
+    words = line.strip().split('\t')
+    path = words[0]
+    if len(path) < 1:
+      continue
+    ref = words[1] if len(words) > 1 else None
+    timer = None
+    if timing_log is not None:
+      timer = StageTimer(timing_log, path=path)
+    try:
+      x = read_x(os.path.join(path, fx0))
+      ref_fname = ref_x = None
+      if ref is not None:
+        ref_fname = os.path.join(ref, forb)
+        ref_x = read_x(os.path.join(ref, fx0))
+      nao = gen_qe_gto(atoms, basis_set, x, params['kpts'],
+        fname=os.path.join(path, forb), mesh=params['mesh'], timer=timer,
+        ref_x=ref_x, ref_fname=ref_fname, **kwargs)
+      reply = '%d' % nao
+    except Exception as err:
+      reply = 'error: %s %s' % (type(err).__name__, err)
+      reply = reply.replace('\n', ' ')
+    if timer is not None:
+      timer.write()
+    fout.write(reply+'\n')
+    fout.flush()
+
 if __name__ == '__main__':
   msg = 'example:\n'
   msg += 'python3 write_pyscf_orbitals.py orbitals.h5'
@@ -74,14 +133,45 @@ if __name__ == '__main__':
   parser.add_argument('lmax', type=int)
   parser.add_argument('fx0', type=str)
   parser.add_argument('--kcut', '-kc', type=float, default=None)
+  parser.add_argument('--nblk', type=int, default=None,
+    help='max. number of orbitals held in memory, default all per kpoint')
+  parser.add_argument('--layout', type=str, default='orbital',
+    choices=['orbital', 'kpoint'],
+    help='one dataset per orbital or one chunked slab per kpoint')
+  parser.add_argument('--nworker', '-nw', type=int, default=1,
+    help='number of processes computing kpoints concurrently')
+  parser.add_argument('--time_reversal', '-tr', action='store_true',
+    help='derive orbitals at -k from those at k')
+  parser.add_argument('--ref', nargs=2, default=None,
+    metavar=('REF_ORB', 'REF_X0'),
+    help='recompute only shells changed from an existing orbital file')
+  parser.add_argument('--serve', action='store_true',
+    help='read directories from stdin, write FORB from FX0 in each')
+  parser.add_argument('--timing', type=str, default=None,
+    help='append per-stage timings as JSON lines to this file')
   args = parser.parse_args()
   kc = args.kcut
 
   lmax = args.lmax
-  try:
-    x = np.loadtxt(args.fx0)
-  except ValueError:
-    x = args.fx0
-  nao = write_orbs(args.forb, args.scf_inp, args.scf_out, lmax, x, kc=kc)
-  print(nao)
+  if args.serve:
+    serve(args.forb, args.scf_inp, args.scf_out, lmax, args.fx0, kc=kc,
+      nblk=args.nblk, layout=args.layout, nworker=args.nworker,
+      time_reversal=args.time_reversal, timing_log=args.timing)
+  else:
+    x = read_x(args.fx0)
+    ref_fname = ref_x = None
+    if args.ref is not None:
+      ref_fname = args.ref[0]
+      ref_x = read_x(args.ref[1])
+    timer = None
+    if args.timing is not None:
+      from afobj.basis.timing import StageTimer
+      timer = StageTimer(args.timing, forb=args.forb)
+    nao = write_orbs(args.forb, args.scf_inp, args.scf_out, lmax, x, kc=kc,
+      nblk=args.nblk, layout=args.layout, nworker=args.nworker,
+      time_reversal=args.time_reversal, ref_x=ref_x, ref_fname=ref_fname,
+      timer=timer)
+    if timer is not None:
+      timer.write()
+    print(nao)
 # end __main__